@@ -0,0 +1,268 @@
+"""
+Zane's Optimizer - layout and export benchmarks
+
+Builds reproducible synthetic image corpora and measures
+PageLayout.calculate_layout, PageLayout._pack_images (guillotine),
+PageLayout._pack_images_maxrects and DocumentExporter.export_to_pdf.
+
+Usage:
+    python benchmarks/run_benchmarks.py                      # compare with baseline.json
+    python benchmarks/run_benchmarks.py --update-baseline    # store a new baseline
+    python benchmarks/run_benchmarks.py --counts 10 100 1000 10000
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from PIL import Image
+
+from layout.page_layout import PageLayout
+from exporter.document_exporter import DocumentExporter
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Page geometry used by every case (default GUI settings)
+MARGIN_MM = 5
+SPACING_MM = 3
+A4_WIDTH_PX = 794
+A4_HEIGHT_PX = 1123
+
+# Regression thresholds
+TIME_TOLERANCE = 0.25         # 25% slower than baseline
+TIME_NOISE_FLOOR = 0.05       # ignore differences below 50 ms
+MEMORY_TOLERANCE = 0.25       # 25% more peak memory
+UTILISATION_TOLERANCE = 0.01  # 1 percentage point
+
+
+def corpus_sizes(kind, count, seed=0):
+    # Reproducible list of (width, height) in pixels for a corpus kind
+    rng = random.Random(f"{kind}-{count}-{seed}")
+    sizes = []
+
+    for _ in range(count):
+        if kind == 'uniform':
+            width, height = 300, 200
+        elif kind == 'mixed_aspect':
+            area = rng.randint(150 * 150, 400 * 400)
+            aspect = rng.choice([0.25, 0.5, 0.75, 1.0, 1.33, 2.0, 4.0])
+            width = int((area * aspect) ** 0.5)
+            height = int(area / width)
+        elif kind == 'tiny':
+            width, height = rng.randint(16, 64), rng.randint(16, 64)
+        elif kind == 'near_page':
+            width, height = rng.randint(600, 760), rng.randint(850, 1080)
+        else:
+            raise ValueError(f"Unknown corpus kind: {kind}")
+        sizes.append((max(1, width), max(1, height)))
+
+    return sizes
+
+
+CORPUS_KINDS = ('uniform', 'mixed_aspect', 'tiny', 'near_page')
+
+
+def write_corpus(sizes, directory):
+    # Write one small JPEG per size (gradient content keeps files small but real)
+    paths = []
+    gradient = Image.linear_gradient('L')
+    for index, (width, height) in enumerate(sizes):
+        shade = gradient.resize((width, height))
+        image = Image.merge('RGB', (shade, shade.transpose(Image.Transpose.FLIP_LEFT_RIGHT), shade))
+        path = os.path.join(directory, f"img_{index:05d}.jpg")
+        image.save(path, quality=85)
+        paths.append(path)
+    return paths
+
+
+def prepared_entries(sizes, page_layout):
+    # Dimension-only entries as PageLayout._prepare_images builds them
+    margin_px = int(MARGIN_MM * 3.78)
+    available_width = A4_WIDTH_PX - 2 * margin_px
+    available_height = A4_HEIGHT_PX - 2 * margin_px
+    entries = []
+
+    for index, (width, height) in enumerate(sizes):
+        was_rotated, was_resized, final_width, final_height, scale = page_layout.image_handler.plan_image_for_page(
+            width, height, available_width, available_height, MARGIN_MM
+        )
+        entries.append({
+            'original_path': f"synthetic_{index}",
+            'image': None,
+            'width': final_width,
+            'height': final_height,
+            'was_rotated': was_rotated,
+            'was_resized': was_resized,
+            'source_width': width,
+            'source_height': height,
+            'scale': scale
+        })
+
+    entries.sort(key=lambda x: (max(x['width'], x['height']), x['width'] * x['height']), reverse=True)
+    return entries
+
+
+def utilisation(pages):
+    # True area utilisation: placed image area / usable area of all pages
+    margin_px = int(MARGIN_MM * 3.78)
+    usable_area = (A4_WIDTH_PX - 2 * margin_px) * (A4_HEIGHT_PX - 2 * margin_px)
+    if not pages:
+        return 0.0
+    placed_area = sum(img['width'] * img['height'] for page in pages for img in page['images'])
+    return placed_area / (len(pages) * usable_area)
+
+
+def measure(function):
+    # Run function twice: once for wall time, once under tracemalloc for peak
+    # Python-side memory (tracing slows the code down too much to time it)
+    # Returns: (result, wall seconds, peak traced bytes)
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def record(results, name, pages, elapsed, peak):
+    results[name] = {
+        'seconds': round(elapsed, 4),
+        'peak_bytes': peak,
+        'pages': len(pages) if pages is not None else None,
+        'utilisation': round(utilisation(pages), 4) if pages is not None else None
+    }
+    print(f"  {name:<45} {elapsed:8.3f}s {peak / 1e6:8.1f}MB "
+          f"pages={results[name]['pages']} util={results[name]['utilisation']}")
+
+
+def run_benchmarks(counts, kinds, export_max, file_max):
+    page_layout = PageLayout()
+    exporter = DocumentExporter()
+    margin_px = int(MARGIN_MM * 3.78)
+    spacing_px = int(SPACING_MM * 3.78)
+    available_width = A4_WIDTH_PX - 2 * margin_px
+    available_height = A4_HEIGHT_PX - 2 * margin_px
+    results = {}
+
+    for kind in kinds:
+        for count in counts:
+            print(f"{kind} x {count}")
+            sizes = corpus_sizes(kind, count)
+            entries = prepared_entries(sizes, page_layout)
+
+            # Packers alone, on dimension data
+            pages, elapsed, peak = measure(lambda: page_layout._pack_images(
+                entries, available_width, available_height, margin_px, spacing_px))
+            record(results, f"{kind}/{count}/pack_guillotine", pages, elapsed, peak)
+
+            pages, elapsed, peak = measure(lambda: page_layout._pack_images_maxrects(
+                entries, available_width, available_height, margin_px, spacing_px))
+            record(results, f"{kind}/{count}/pack_maxrects", pages, elapsed, peak)
+
+            if count > file_max:
+                continue
+
+            # Full pipeline on real files
+            directory = tempfile.mkdtemp(prefix='zo_bench_')
+            try:
+                paths = write_corpus(sizes, directory)
+
+                pages, elapsed, peak = measure(lambda: page_layout.calculate_layout(
+                    paths, MARGIN_MM, SPACING_MM, load_pixels=False))
+                record(results, f"{kind}/{count}/calculate_layout", pages, elapsed, peak)
+
+                if count <= export_max:
+                    output_path = os.path.join(directory, 'out.pdf')
+                    _, elapsed, peak = measure(lambda: exporter.export_to_pdf(pages, output_path))
+                    record(results, f"{kind}/{count}/export_to_pdf", pages, elapsed, peak)
+                    results[f"{kind}/{count}/export_to_pdf"]['pdf_bytes'] = os.path.getsize(output_path)
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    return results
+
+
+def compare(results, baseline):
+    # Returns: list of regression messages
+    regressions = []
+
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+
+        slower = current['seconds'] - previous['seconds']
+        if slower > TIME_NOISE_FLOOR and current['seconds'] > previous['seconds'] * (1 + TIME_TOLERANCE):
+            regressions.append(f"{name}: time {previous['seconds']:.3f}s -> {current['seconds']:.3f}s")
+
+        if current['peak_bytes'] > previous['peak_bytes'] * (1 + MEMORY_TOLERANCE) + 1e6:
+            regressions.append(f"{name}: peak memory {previous['peak_bytes']} -> {current['peak_bytes']} bytes")
+
+        if current['pages'] is not None and previous['pages'] is not None:
+            if current['pages'] > previous['pages']:
+                regressions.append(f"{name}: pages {previous['pages']} -> {current['pages']}")
+            if current['utilisation'] < previous['utilisation'] - UTILISATION_TOLERANCE:
+                regressions.append(f"{name}: utilisation {previous['utilisation']} -> {current['utilisation']}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark layout packing and PDF export")
+    parser.add_argument('--counts', type=int, nargs='+', default=[10, 100, 1000],
+                        help="corpus sizes (default: 10 100 1000; add 10000 for a full run)")
+    parser.add_argument('--kinds', nargs='+', default=list(CORPUS_KINDS), choices=CORPUS_KINDS)
+    parser.add_argument('--export-max', type=int, default=100,
+                        help="largest corpus exported to PDF (default: 100)")
+    parser.add_argument('--file-max', type=int, default=1000,
+                        help="largest corpus written to disk for calculate_layout (default: 1000)")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="store these results as the new baseline")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.counts, args.kinds, args.export_max, args.file_max)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --update-baseline first")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline)
+    if regressions:
+        print("\nRegressions:")
+        for message in regressions:
+            print(f"  {message}")
+        return 1
+
+    print("\nNo regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+import io
+import zlib
+
+from PIL import Image
+from reportlab.lib.utils import ImageReader
+
+# Choice of PDF image compression per image
+# Photographs compress far better as JPEG (DCTDecode) at the configured
+# quality; flat graphics (line art, screenshots, scans of text) stay exact and
+# small with lossless Flate, where JPEG would blur edges and ring around them.
+# Images are classified on a small nearest-neighbour sample: nearest keeps the
+# exact pixel values, so colour counts and histograms stay representative.
+
+COMPRESSION_AUTO = 'auto'          # JPEG for photos, Flate for graphics
+COMPRESSION_LOSSLESS = 'lossless'  # Flate for everything
+
+KIND_PHOTO = 'photo'
+KIND_GRAPHIC = 'graphic'
+
+SAMPLE_SIZE = 128          # Longest side of the classification sample
+GRAPHIC_MAX_COLORS = 1024  # Fewer distinct colours in the sample: flat graphic
+GRAPHIC_MAX_ENTROPY = 5.0  # Lower grey histogram entropy (bits): flat graphic
+
+
+class CompressionPolicy:
+    def __init__(self, jpeg_quality=95, compression=COMPRESSION_AUTO):
+        # jpeg_quality: 1-100, used for images classified as photos
+        # compression: COMPRESSION_AUTO or COMPRESSION_LOSSLESS
+        self.jpeg_quality = max(1, min(100, int(jpeg_quality)))
+        self.compression = compression
+
+    def classify(self, image):
+        # Returns: KIND_PHOTO or KIND_GRAPHIC
+        mode = image.mode
+        if mode in ('1', 'P', 'PA'):
+            return KIND_GRAPHIC  # Bilevel and palette images are flat by nature
+        if mode not in ('L', 'RGB'):
+            return KIND_GRAPHIC  # Alpha needs a lossless soft mask; CMYK etc. kept exact
+
+        sample = image
+        if max(image.size) > SAMPLE_SIZE:
+            scale = SAMPLE_SIZE / max(image.size)
+            sample = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                                  Image.NEAREST)
+
+        if mode == 'RGB':
+            if sample.getcolors(GRAPHIC_MAX_COLORS) is None:
+                return KIND_PHOTO
+            # Few colours: a flat graphic, or grey content stored as RGB (at
+            # most 256 colours), which the grey test below tells apart
+            sample = sample.convert('L')
+
+        # 256 grey levels at most, so count how spread the histogram is
+        return KIND_GRAPHIC if sample.entropy() < GRAPHIC_MAX_ENTROPY else KIND_PHOTO
+
+    def image_reader(self, image):
+        # ReportLab image for drawImage, compressed the way its kind suggests
+        # Returns: (ImageReader, kind)
+        if self.compression == COMPRESSION_LOSSLESS:
+            return ImageReader(image), KIND_GRAPHIC
+
+        kind = self.classify(image)
+        if kind == KIND_GRAPHIC:
+            return ImageReader(image), kind
+
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=self.jpeg_quality, optimize=True)
+        return JpegImageReader(buffer), kind
+
+    def cache_key(self):
+        # Settings an encoded image depends on, for keys of cached entries
+        return ('encoded', self.compression, self.jpeg_quality)
+
+    def cache_entry(self, image, image_reader, kind):
+        # Compact, picklable form of an image_reader result for the disk cache:
+        # the JPEG data as encoded, or the graphic's pixels Flate-compressed
+        # (flat graphics shrink a lot, and any mode can be stored)
+        if isinstance(image_reader, JpegImageReader):
+            return kind, 'jpeg', image_reader.fp.getvalue()
+        palette = image.getpalette() if image.mode == 'P' else None
+        return kind, 'pixels', (image.mode, image.size, palette, zlib.compress(image.tobytes(), 1))
+
+    def image_reader_from_cache(self, entry):
+        # Returns: (ImageReader, kind) for a cache_entry result
+        kind, form, data = entry
+        if form == 'jpeg':
+            return JpegImageReader(io.BytesIO(data)), kind
+
+        mode, size, palette, pixels = data
+        image = Image.frombytes(mode, size, zlib.decompress(pixels))
+        if palette is not None:
+            image.putpalette(palette)
+        return ImageReader(image), kind
+
+
+class JpegImageReader(ImageReader):
+    # ImageReader for JPEG data encoded in memory
+    # ReportLab embeds the data as is (DCTDecode); drawImage names images by a
+    # digest of getRGBData, which is taken from the encoded bytes here instead
+    # of decoding them again
+    def getRGBData(self):
+        self._dataA = None
+        return self.fp.getvalue()
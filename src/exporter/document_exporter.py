@@ -1,33 +1,92 @@
 import os
-import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from reportlab import rl_config
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
-from reportlab.pdfgen import canvas
 from PIL import Image
+from image_processor.image_handler import ImageHandler, LAYOUT_DPI, RESAMPLE_FILTERS, RESAMPLE_QUALITY
+from exporter.compression_policy import CompressionPolicy, COMPRESSION_AUTO, KIND_PHOTO
+from exporter.export_canvas import BuildOnceTable, ExportCanvas, make_image_object
+
+# Write image streams as binary: ASCII85 text encoding adds 25% to every image
+rl_config.useA85 = 0
+
+# Images kept in the encoding pool per worker: upcoming pages are read ahead
+# until this many are queued, so pages with one image still run in parallel.
+# Every queued image holds its pixels and encoded data, so peak memory grows
+# with the window: it is capped, whatever the worker count.
+ENCODE_AHEAD_PER_WORKER = 2
+ENCODE_AHEAD_MAX = 16
 
 class DocumentExporter:
-    def __init__(self):
+    def __init__(self, image_handler=None):
+        # image_handler: shared ImageHandler (and its caches), or None for a new one
         self.a4_width = 210  # mm
         self.a4_height = 297  # mm
+        self.image_handler = image_handler or ImageHandler()
         
-    def export_to_pdf(self, pages, output_path):
+    def export_to_pdf(self, pages, output_path, dpi=LAYOUT_DPI, resample=RESAMPLE_QUALITY, jpeg_passthrough=True,
+                      jpeg_quality=95, compression=COMPRESSION_AUTO, page_compression=True, workers=None,
+                      reproducible=False):
         # Export layout to PDF document with precise positioning
+        # pages: list of pages or an iterator such as PageLayout.iter_pages
+        #        (see export_layout); pages are consumed one at a time and the
+        #        pixels rendered for one are freed once its images are written,
+        #        so with dimension-only pages memory stays at about one page
+        # dpi: print resolution; every image is embedded with exactly the pixels
+        #      its placed size needs at this resolution (or fewer, never upscaled)
+        # resample: RESAMPLE_QUALITY or RESAMPLE_FAST filter for that resampling
+        # jpeg_passthrough: embed source JPEGs that need no pixel change as they
+        #                   are (DCTDecode), without decoding or re-encoding
+        # jpeg_quality: JPEG quality for re-encoded images classified as photos
+        # compression: COMPRESSION_AUTO (JPEG for photos, Flate for flat graphics)
+        #              or COMPRESSION_LOSSLESS (Flate for everything)
+        # page_compression: Flate-compress the page content streams
+        # workers: threads encoding image streams (None = image handler's
+        #          setting, else one per CPU; 1 = no pool); images of upcoming
+        #          pages are encoded ahead (see ENCODE_AHEAD_PER_WORKER), but the
+        #          PDF itself is assembled in page order, so the output doesn't
+        #          depend on this
+        # reproducible: leave out creation date and random document ID, so the
+        #               same input always gives byte-identical files
+        # Image counts per path are kept in self.last_export_stats
+        self.last_export_stats = {'passthrough': 0, 'jpeg': 0, 'flate': 0}
+        policy = CompressionPolicy(jpeg_quality, compression)
+        if workers is None:
+            workers = self.image_handler.workers
+        if workers is None:
+            # Encoding is CPU-bound (Pillow and zlib release the GIL): more
+            # threads than cores would only hold more images in memory
+            workers = os.cpu_count() or 1
+        executor = ThreadPoolExecutor(max_workers=workers) if workers != 1 else None
+        built = BuildOnceTable()  # Image objects made for this document, by content name
+        # Encoded placements, by source and transform; once drawn, their
+        # streams wait in the canvas's spool file, not in memory
+        placed = BuildOnceTable()
         try:
             # Create PDF canvas
-            c = canvas.Canvas(output_path, pagesize=A4)
+            c = ExportCanvas(output_path, pagesize=A4, pageCompression=1 if page_compression else 0,
+                             invariant=1 if reproducible else 0)
             page_width_pt, page_height_pt = A4
             
             ### print(f"DEBUG: Exporting {len(pages)} pages to PDF")
             
-            for page_num, page in enumerate(pages):
+            # Encode stage: image streams (render, resample, compress) on the
+            # pool, running ahead of the page being written
+            encode = lambda img_data: self._encode_placement(img_data, dpi, resample, jpeg_passthrough, policy,
+                                                             built, placed)
+            encoded_pages = self._encode_ahead(pages, executor, encode,
+                                               min(workers * ENCODE_AHEAD_PER_WORKER, ENCODE_AHEAD_MAX))
+            
+            for page_num, (page, encoded_images) in enumerate(encoded_pages):
                 ### print(f"DEBUG: Processing page {page_num + 1} with {len(page['images'])} images")
                 
                 if page_num > 0:
                     c.showPage()  # Start new page
                 
-                for img_num, img_data in enumerate(page['images']):
-                    # Get image data
-                    pil_image = img_data['image']
+                # Assembly stage: place them in layout order
+                for img_data, (image_object, path_name, source_orientation) in zip(page['images'], encoded_images):
                     img_width_px = img_data['width']
                     img_height_px = img_data['height']
                     
@@ -45,30 +104,207 @@ class DocumentExporter:
                     
                     ### print(f"DEBUG: Image {img_num + 1} at ({x_pt:.1f}pt, {y_pt:.1f}pt) size {width_pt:.1f}x{height_pt:.1f}pt")
                     
-                    # Save image to temporary file
-                    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
-                        pil_image.save(temp_file, format='PNG')
-                        temp_path = temp_file.name
-                    
-                    # Draw image at calculated position
-                    c.drawImage(temp_path, x_pt, y_pt, 
-                               width=width_pt, height=height_pt)
-                    
-                    # Clean up temp file
-                    os.unlink(temp_path)
+                    if source_orientation and img_data['rotated']:
+                        self._draw_rotated(c, image_object, x_pt, y_pt, width_pt, height_pt)
+                    else:
+                        c.drawImageObject(image_object, x_pt, y_pt, width_pt, height_pt)
+                    self.last_export_stats[path_name] += 1
+                
+                # Let go of this page (and any pixels it carries) before the
+                # iterator produces the next one
+                page = img_data = encoded_images = None
             
             # Save PDF
             c.save()
             ### print(f"DEBUG: PDF saved successfully to {output_path}")
-            return True, f"PDF document saved to {output_path}"
+            return True, (f"PDF document saved to {output_path}\n"
+                          f"{self.last_export_stats['passthrough']} JPEG image(s) embedded unchanged, "
+                          f"{self.last_export_stats['jpeg']} encoded as JPEG, "
+                          f"{self.last_export_stats['flate']} lossless")
             
         except Exception as e:
             print(f"DEBUG: Error exporting to PDF: {str(e)}")
             return False, f"Error exporting to PDF: {str(e)}"
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+    
+    def _encode_ahead(self, pages, executor, encode, window):
+        # Yield (page, its encoded images) in page order
+        # With a pool, the images of upcoming pages are submitted until about
+        # window images are queued (at least the page being written)
+        if executor is None:
+            for page in pages:
+                yield page, map(encode, page['images'])
+            return
+        
+        pending = deque()  # (page, futures), oldest first
+        queued = 0
+        pages = iter(pages)
+        more_pages = True
+        while True:
+            while more_pages and (not pending or queued < window):
+                page = next(pages, None)
+                if page is None:
+                    more_pages = False
+                    break
+                futures = [executor.submit(encode, img_data) for img_data in page['images']]
+                pending.append((page, futures))
+                queued += len(futures)
+            
+            if not pending:
+                return
+            page, futures = pending.popleft()
+            queued -= len(futures)
+            yield page, (future.result() for future in futures)
+    
+    def _encode_placement(self, img_data, dpi, resample, jpeg_passthrough, policy, built, placed):
+        # _encode_image, shared by placements of the same file with the same
+        # rotation and size: export renders aren't cached (keep=False), so a
+        # repeated image would otherwise be decoded and resampled every time
+        key = (img_data['original_path'], img_data['rotated'], img_data['width'], img_data['height'])
+        return placed.get_or_build(key, lambda: self._encode_image(img_data, dpi, resample, jpeg_passthrough,
+                                                                   policy, built))
+    
+    def _encode_image(self, img_data, dpi, resample, jpeg_passthrough, policy, built):
+        # Build one placement's PDF image object (runs on the encoding threads)
+        # Returns: (image object, stats key, True if still in source orientation)
+        jpeg_path = self._passthrough_jpeg(img_data, dpi) if jpeg_passthrough else None
+        if jpeg_path is not None:
+            # ReportLab embeds a file named .jpg/.jpeg as its DCT stream
+            return make_image_object(jpeg_path, built=built), 'passthrough', True
+        
+        # Placements rendered from the source file are kept in the prepared
+        # image cache in encoded form, so exporting again skips decoding,
+        # resampling and compression
+        target_size, from_source = self._print_target(img_data, dpi)
+        prepared_cache = self.image_handler.prepared_cache
+        cache_key = None
+        if from_source and prepared_cache is not None:
+            cache_key = prepared_cache.make_key(img_data['original_path'], img_data['rotated'],
+                                                target_size[0], target_size[1], resample)
+            if cache_key is not None:
+                cache_key += policy.cache_key()
+        
+        entry = prepared_cache.get_encoded(cache_key) if cache_key is not None else None
+        if entry is not None:
+            image_reader, kind = policy.image_reader_from_cache(entry)
+        else:
+            # Get image data at the print resolution (dimension-only
+            # layouts are rendered here)
+            pil_image = self._pdf_image(self._image_for_print(img_data, dpi, resample))
+            
+            # Straight from memory (native mode, see _pdf_image), compressed as
+            # JPEG or Flate by the policy
+            image_reader, kind = policy.image_reader(pil_image)
+            if cache_key is not None:
+                prepared_cache.put_encoded(cache_key, policy.cache_entry(pil_image, image_reader, kind))
+        
+        # mask='auto': an alpha channel becomes the image's soft mask
+        return make_image_object(image_reader, 'auto', built), 'jpeg' if kind == KIND_PHOTO else 'flate', False
+    
+    def _passthrough_jpeg(self, img_data, dpi):
+        # Source JPEG that can go into the PDF byte for byte: the print needs at
+        # least as many pixels as the file has, so only a rotation (done by the
+        # page transform, see _draw_rotated) and scaling by the PDF viewer remain
+        # Returns: file path, or None when pixels have to change
+        path = img_data['original_path']
+        if os.path.splitext(path)[1].lower() not in ('.jpg', '.jpeg'):
+            return None  # ReportLab only passes JPEGs through by extension
+        
+        try:
+            metadata = self.image_handler.get_image_metadata(path)
+        except Exception:
+            return None
+        if metadata['format'] != 'JPEG' or metadata['mode'] not in ('L', 'RGB'):
+            return None
+        
+        source_width, source_height = metadata['width'], metadata['height']
+        if img_data['rotated']:
+            source_width, source_height = source_height, source_width
+        
+        # More pixels than the print needs: downsample and re-encode instead
+        # (one pixel of slack for rounding)
+        needed_width, needed_height = self.image_handler.print_size(img_data['width'], img_data['height'], dpi)
+        if source_width > needed_width + 1 or source_height > needed_height + 1:
+            return None
+        return path
+    
+    def _draw_rotated(self, c, image_object, x_pt, y_pt, width_pt, height_pt):
+        # Draw an image still in source orientation (passed-through JPEG) into a
+        # rotated placement: turned 90 degrees clockwise by the page transform,
+        # which is lossless, the JPEG data stays untouched
+        c.saveState()
+        c.translate(x_pt, y_pt + height_pt)
+        c.rotate(-90)
+        c.drawImageObject(image_object, 0, 0, height_pt, width_pt)
+        c.restoreState()
+    
+    def _image_for_print(self, img_data, dpi, resample):
+        # Resample a placement to the pixels it needs at dpi, before encoding
+        # Returns: PIL image
+        target_size, from_source = self._print_target(img_data, dpi)
+        image = img_data['image']
+        
+        if not from_source:
+            if image.size == target_size:
+                return image
+            return self.image_handler.resample_image(image, target_size, RESAMPLE_FILTERS[resample])
+        # One-off render: not kept in the memory cache (keep=False)
+        return self.image_handler.render_image(img_data['original_path'], img_data['rotated'],
+                                               target_size[0], target_size[1], resample, keep=False)
+    
+    def _print_target(self, img_data, dpi):
+        # Pixels a placement needs at dpi, and where they come from: detail
+        # comes from the source file when the layout's bitmap is smaller
+        # Returns: ((width, height), True to render from the source file)
+        image = img_data['image']
+        width, height = img_data['width'], img_data['height']
+        
+        try:
+            source_size = self.image_handler.get_image_size(img_data['original_path'])
+            if img_data['rotated']:
+                source_size = source_size[::-1]
+        except Exception:
+            if image is None:
+                raise
+            source_size = None  # No source to go back to, only the layout's bitmap
+        
+        target_size = self.image_handler.print_size(width, height, dpi, source_size or image.size)
+        
+        if image is not None and (image.size == target_size or source_size is None
+                                  or image.width > target_size[0]):
+            return target_size, False
+        return target_size, True
+    
+    def _pdf_image(self, pil_image):
+        # Smallest mode ReportLab embeds without losing anything
+        # ReportLab writes L/LA as DeviceGray and RGBA/LA alpha as a soft mask,
+        # but expands 1 and P to RGB and drops PA alpha
+        mode = pil_image.mode
+        if mode == '1':
+            return pil_image.convert('L')
+        if mode == 'PA' or (mode == 'P' and 'transparency' in pil_image.info):
+            return pil_image.convert('RGBA')
+        if mode == 'P' and self.image_handler.has_grey_palette(pil_image):
+            return pil_image.convert('L')
+        return pil_image
+    
+    def export_layout(self, page_layout, image_paths, output_path, layout_options=None, **export_options):
+        # Lay out and export in one pass, without the whole document in memory:
+        # dimension-only pages come from page_layout.iter_pages and each is
+        # rendered, encoded and written before the next is laid out
+        # layout_options: keyword arguments for iter_pages (margin_mm, spacing_mm, ...)
+        # export_options: keyword arguments for export_to_pdf
+        pages = page_layout.iter_pages(image_paths, load_pixels=False, **(layout_options or {}))
+        return self.export_to_pdf(pages, output_path, **export_options)
     
-    def export_document(self, pages, output_path, format_type='pdf'):
+    def export_document(self, pages, output_path, format_type='pdf', dpi=LAYOUT_DPI, resample=RESAMPLE_QUALITY,
+                        jpeg_passthrough=True, jpeg_quality=95, compression=COMPRESSION_AUTO, page_compression=True,
+                        workers=None, reproducible=False):
         # Main export method - PDF only supported
         if format_type.lower() == 'pdf':
-            return self.export_to_pdf(pages, output_path)
+            return self.export_to_pdf(pages, output_path, dpi, resample, jpeg_passthrough,
+                                      jpeg_quality, compression, page_compression, workers, reproducible)
         else:
             return False, f"Unsupported format: {format_type}. Only PDF is supported."
\ No newline at end of file
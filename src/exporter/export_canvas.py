@@ -0,0 +1,195 @@
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import Future
+
+from reportlab.pdfbase.pdfdoc import PDFDocument, PDFImageXObject, PDFObject, PDFObjectReference
+from reportlab.pdfgen import canvas
+
+# Canvas that draws image XObjects built ahead of time
+# Canvas.drawImage decodes, digests and compresses an image while the page is
+# being written, all on one thread. Building the PDFImageXObject separately
+# (make_image_object, safe to run on a worker thread) leaves only the
+# registration and the page operators to drawImageObject, which is cheap and
+# must run in page order so object numbers come out the same on every run.
+# ReportLab also keeps every image stream in memory until save, then builds
+# the whole file in memory before writing it. ExportCanvas instead moves each
+# stream to a temporary spool file when the image is first drawn, and save
+# writes the file object by object, reading each stream back only while it is
+# written: memory no longer grows with the document's image data.
+
+
+def make_image_object(source, mask=None, built=None):
+    # source: ImageReader or file path, as for Canvas.drawImage
+    # built: BuildOnceTable of the document's image objects; an identical
+    #        image is taken from there instead of compressed again
+    # Returns: PDFImageXObject named by its content, so identical images are
+    #          stored once
+    name = image_name(source, mask)
+    if built is None:
+        return _build_image_object(name, source, mask)
+    return built.get_or_build(name, lambda: _build_image_object(name, source, mask))
+
+
+def _build_image_object(name, source, mask):
+    image_object = PDFImageXObject(name, source, mask=mask)
+    smask = getattr(image_object, '_smask', None)
+    if smask is not None:
+        smask.name = hashlib.md5(f"{smask.width}x{smask.height}/".encode('utf-8') + smask.streamContent).hexdigest()
+    return image_object
+
+
+class BuildOnceTable:
+    # Results built once per key for one document, shared by the encoding
+    # threads: the first thread to ask for a key builds it, others asking for
+    # the same key meanwhile wait for that result instead of doing the same
+    # work again
+    def __init__(self):
+        self._objects = {}  # key -> Future of the result
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        with self._lock:
+            future = self._objects.get(key)
+            owner = future is None
+            if owner:
+                future = self._objects[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            result = build()
+        except Exception as e:
+            with self._lock:
+                del self._objects[key]  # Let a later request try again
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+
+def image_name(source, mask=None):
+    # Content digest as Canvas.drawImage computes it, plus size and mode:
+    # drawImage alone gives e.g. a solid 100x300 and 300x100 image one name
+    digest = hashlib.md5()
+    if isinstance(source, str):
+        digest.update(f"{os.path.abspath(source)}/{mask}".encode('utf-8'))
+        return digest.hexdigest()
+
+    data = source.getRGBData()
+    width, height = source.getSize()
+    digest.update(f"{width}x{height}/{getattr(source, 'mode', None)}/".encode('utf-8'))
+    digest.update(data)
+    alpha = source._dataA if mask == 'auto' else None
+    digest.update(alpha.getRGBData() if alpha is not None else str(mask).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class SpooledImage(PDFObject):
+    # Registered in place of an image XObject: its stream waits in the spool
+    # file and is put back only while the object is formatted
+    def __init__(self, image_object, spool):
+        content = image_object.streamContent
+        if isinstance(content, str):
+            content = content.encode('latin-1')  # ASCII85 text
+        spool.seek(0, os.SEEK_END)
+        self.offset = spool.tell()
+        self.length = len(content)
+        spool.write(content)
+        image_object.streamContent = None
+        self.image_object = image_object
+        self.spool = spool
+
+    def format(self, document):
+        self.spool.seek(self.offset)
+        self.image_object.streamContent = self.spool.read(self.length)
+        try:
+            return self.image_object.format(document)
+        finally:
+            self.image_object.streamContent = None
+
+
+class StreamingDocument(PDFDocument):
+    # PDFDocument.format collects the whole file in an in-memory PDFFile, which
+    # it keeps in self.__accum__ while formatting. When _output is set, the
+    # collector is caught there and everything added to it goes straight to
+    # _output instead; its own copy stays empty.
+    _output = None
+
+    @property
+    def __accum__(self):
+        return self.__dict__['__accum__']
+
+    @__accum__.setter
+    def __accum__(self, collector):
+        if self._output is not None:
+            for data in collector.strings:  # The header, added on creation
+                self._output.write(data)
+            collector.strings = []
+            collector.write = self._output.write
+        self.__dict__['__accum__'] = collector
+
+    @__accum__.deleter
+    def __accum__(self):
+        del self.__dict__['__accum__']
+
+
+class ExportCanvas(canvas.Canvas):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._doc.__class__ = StreamingDocument  # Made by Canvas.__init__
+        self._spool = None  # Temporary file holding the image streams drawn so far
+
+    def save(self):
+        # Canvas.save, writing the file as it is formatted (see StreamingDocument)
+        if len(self._code):
+            self.showPage()
+        try:
+            if hasattr(self._filename, 'write'):
+                self._doc._output = self._filename
+                self._doc.GetPDFData(self)
+            else:
+                with open(self._filename, 'wb') as output:
+                    self._doc._output = output
+                    self._doc.GetPDFData(self)
+        finally:
+            self._doc._output = None
+            if self._spool is not None:
+                self._spool.close()
+
+    def drawImageObject(self, image_object, x, y, width, height):
+        # Canvas.drawImage for a make_image_object result
+        # The image's stream moves to the spool file on first use, so the
+        # object itself keeps only its description afterwards
+        self._currentPageHasImages = 1
+
+        name = image_object.name
+        regName = self._doc.getXObjectName(name)
+        if regName not in self._doc.idToObject:
+            # First use: register the image (and its soft mask) with the document
+            self._setXObjects(image_object)
+            spooled = self._spooled(image_object)
+            self._doc.Reference(spooled, regName)
+            self._doc.addForm(name, spooled)
+            smask = getattr(image_object, '_smask', None)
+            if smask is not None:
+                mRegName = self._doc.getXObjectName(smask.name)
+                if mRegName not in self._doc.idToObject:
+                    self._setXObjects(smask)
+                    image_object.smask = self._doc.Reference(self._spooled(smask), mRegName)
+                else:
+                    image_object.smask = PDFObjectReference(mRegName)
+                del image_object._smask
+
+        self.saveState()
+        self.translate(x, y)
+        self.scale(width, height)
+        self._code.append("/%s Do" % regName)
+        self.restoreState()
+        self._formsinuse.append(name)
+
+    def _spooled(self, image_object):
+        if self._spool is None:
+            self._spool = tempfile.TemporaryFile()
+        return SpooledImage(image_object, self._spool)
@@ -1,12 +1,14 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
-from PIL import Image, ImageTk
+from image_processor.image_handler import ImageHandler
 
 class ImageSelection:
-    def __init__(self, parent_frame, update_callback=None):
+    def __init__(self, parent_frame, update_callback=None, image_handler=None):
         self.parent = parent_frame
         self.update_callback = update_callback  # Callback to update main window
+        # Shared with the layout, so file headers are read once per session
+        self.image_handler = image_handler or ImageHandler()
         self.selected_images = []
         self.setup_image_selection_ui()
         
@@ -87,24 +89,20 @@ class ImageSelection:
         if files:
             new_images = []
             unsupported_files = []
-            oversized_files = []
+            unreadable_files = []
             
-            # Calculate max allowed size (A4 page with margins)
-            # A4: 794x1123 pixels at 96 DPI
-            max_width = 794 - (5 * 3.78 * 2)  # 5mm margins both sides
-            max_height = 1123 - (5 * 3.78 * 2)
-            
-            a4_width_px = 794   # 210mm * 3.78
-            a4_height_px = 1123 # 297mm * 3.78
+            # Read all headers in one parallel batch; validation below is then
+            # answered from the handler's cache
+            self.image_handler.probe_many([f for f in files if self.is_supported_image(f)])
             
             for file_path in files:
                 if self.is_supported_image(file_path):
-                    # Validate image size
-                    is_valid, error_msg = self.validate_image_size(file_path, a4_width_px, a4_height_px)
+                    # Validate image (header only, any size is accepted)
+                    is_valid, error_msg = self.validate_image_size(file_path)
                     if is_valid:
                         new_images.append(file_path)
                     else:
-                        oversized_files.append(f"{os.path.basename(file_path)}: {error_msg}")
+                        unreadable_files.append(f"{os.path.basename(file_path)}: {error_msg}")
                 else:
                     unsupported_files.append(os.path.basename(file_path))
             
@@ -116,14 +114,14 @@ class ImageSelection:
             all_warnings = []
             if unsupported_files:
                 all_warnings.append(f"Unsupported format: {', '.join(unsupported_files[:3])}")
-            if oversized_files:
-                all_warnings.append(f"Too large: {', '.join(oversized_files[:3])}")
+            if unreadable_files:
+                all_warnings.append(f"Unreadable: {', '.join(unreadable_files[:3])}")
             
             if all_warnings:
                 messagebox.showwarning(
                     "Some images were not added",
                     "\n".join(all_warnings) + 
-                    f"\n\n{len(unsupported_files) + len(oversized_files)} file(s) skipped."
+                    f"\n\n{len(unsupported_files) + len(unreadable_files)} file(s) skipped."
                 )
             
             # Update callback if provided
@@ -170,17 +168,15 @@ class ImageSelection:
         for item in self.image_tree.get_children():
             self.image_tree.delete(item)
         
-        # Add images to treeview
-        for image_path in self.selected_images:
+        # Add images to treeview (headers probed in one batch, cached per file version)
+        probes = self.image_handler.probe_many(self.selected_images)
+        for image_path, metadata in zip(self.selected_images, probes):
             try:
-                # Get image info
-                with Image.open(image_path) as img:
-                    width, height = img.size
-                    dimensions = f"{width}×{height}"
+                if isinstance(metadata, Exception):
+                    raise metadata
                 
-                # Get file size
-                file_size = os.path.getsize(image_path)
-                size_kb = file_size / 1024
+                dimensions = f"{metadata['width']}×{metadata['height']}"
+                size_kb = metadata['file_size'] / 1024
                 size_text = f"{size_kb:.1f} KB"
                 
                 # Get filename and path
@@ -220,15 +216,14 @@ class ImageSelection:
         self.selected_images = image_paths.copy()
         self.update_image_list()
         
-    def validate_image_size(self, file_path, max_width, max_height):
-        # Simple validation using PIL
+    def validate_image_size(self, file_path):
+        # Simple validation from the header (cached for the later list and layout)
+        # Images larger than the page are accepted: the layout fits them to the
+        # page and they are decoded at reduced size, never at full resolution
         try:
-            from PIL import Image
-            with Image.open(file_path) as img:
-                width, height = img.size
-                # Allow images up to 2x the max size (will be resized)
-                if width > max_width or height > max_height:
-                    return False, f"{width}x{height}px"
-                return True, None
+            width, height = self.image_handler.get_image_size(file_path)
+            if width <= 0 or height <= 0:
+                return False, f"{width}x{height}px"
+            return True, None
         except:
             return False, "Cannot read image"
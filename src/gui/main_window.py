@@ -2,7 +2,7 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
 import sys
-import copy
+from collections import Counter
 
 # Add the src directory to Python path so we can import our modules
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -13,6 +13,8 @@ from gui.image_selection import ImageSelection
 from gui.settings_panel import SettingsPanel
 from gui.preview_panel import PreviewPanel
 from layout.page_layout import PageLayout
+from layout.layout_cache import LayoutCache
+from image_processor.prepared_image_cache import PreparedImageCache
 from exporter.document_exporter import DocumentExporter
 
 from PIL import Image, ImageTk
@@ -24,11 +26,28 @@ class MainWindow:
         self.root.geometry("1000x700")
         
         # Initialize modules
-        self.page_layout = PageLayout()
-        self.document_exporter = DocumentExporter()
+        # Layouts are cached in memory and under the user's home directory,
+        # so toggling settings back or reopening a session is instant
+        layout_cache_dir = os.path.join(os.path.expanduser('~'), '.zanes_optimizer', 'layout_cache')
+        try:
+            self.layout_cache = LayoutCache(cache_dir=layout_cache_dir)
+        except OSError as e:
+            print(f"Could not create layout cache directory: {e}")
+            self.layout_cache = LayoutCache()
+        # Decoded, resized images are kept on disk too: re-exporting the same
+        # folder skips the decode/rotate/resize work
+        image_cache_dir = os.path.join(os.path.expanduser('~'), '.zanes_optimizer', 'image_cache')
+        try:
+            self.prepared_cache = PreparedImageCache(image_cache_dir)
+        except OSError as e:
+            print(f"Could not create image cache directory: {e}")
+            self.prepared_cache = None
+        self.page_layout = PageLayout(layout_cache=self.layout_cache, prepared_cache=self.prepared_cache)
+        self.document_exporter = DocumentExporter(self.page_layout.image_handler)
         
         self.selected_images = []
         self.current_page_layouts = []
+        self.laid_out_images = []  # Image paths current_page_layouts was computed for
         
         self.setup_ui()
         self.set_window_icon()
@@ -55,7 +74,8 @@ class MainWindow:
         image_selection_frame.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 10))
         image_selection_frame.columnconfigure(0, weight=1)
         
-        self.image_selection = ImageSelection(image_selection_frame, self.on_images_updated)
+        self.image_selection = ImageSelection(image_selection_frame, self.on_images_updated,
+                                              self.page_layout.image_handler)
         self.image_selection.setup_image_selection_ui()
         
         # LEFT COLUMN: Settings Section
@@ -91,12 +111,13 @@ class MainWindow:
         if images:
             # Show basic image selection preview
             self.preview_panel.show_image_selection(images)
-            # Calculate and show layout preview
-            self.calculate_layout_preview()
+            # Calculate and show layout preview, reusing the current layout if there is one
+            self.calculate_layout_preview(incremental=True)
         else:
             ### print("DEBUG: Clearing preview and page layouts")
             self.preview_panel.clear_preview()
             self.current_page_layouts = []
+            self.laid_out_images = []
 
     
     def on_settings_updated(self, settings):
@@ -105,8 +126,9 @@ class MainWindow:
             # Recalculate layout when settings change
             self.calculate_layout_preview()
     
-    def calculate_layout_preview(self):
+    def calculate_layout_preview(self, incremental=False):
         # Calculate layout and update preview
+        # incremental: only place added images / drop removed ones from the current layout
         if not self.selected_images:
             return
             
@@ -118,27 +140,52 @@ class MainWindow:
             settings = self.settings_panel.get_settings()
             ### print(f"DEBUG: Processing {len(self.selected_images)} images with settings: {settings}")
 
-            # Calculate layout
-            page_layouts = self.page_layout.calculate_layout(
-                image_paths=self.selected_images,
-                margin_mm=settings['margin_mm'],
-                spacing_mm=settings['spacing_mm'],
-                allow_rotation=settings['allow_rotation'],
-                max_reduction=settings['max_reduction']  # Fixed parameter name
-            )
+            # A page-saving shrink depends on every image, so it always repacks fully
+            if incremental and self.current_page_layouts and not settings['optimize_scale']:
+                # Diff against the images the current layout was computed for
+                selected = Counter(self.selected_images)
+                laid_out = Counter(self.laid_out_images)
+                page_layouts = self.page_layout.update_layout(
+                    self.current_page_layouts,
+                    added_paths=list((selected - laid_out).elements()),
+                    removed_paths=list((laid_out - selected).elements()),
+                    margin_mm=settings['margin_mm'],
+                    spacing_mm=settings['spacing_mm'],
+                    allow_rotation=settings['allow_rotation'],
+                    max_reduction=settings['max_reduction'],
+                    load_pixels=False
+                )
+            else:
+                # Calculate layout page by page, drawing each page as it is packed
+                page_layouts = self.page_layout.iter_pages(
+                    image_paths=self.selected_images,
+                    margin_mm=settings['margin_mm'],
+                    spacing_mm=settings['spacing_mm'],
+                    allow_rotation=settings['allow_rotation'],
+                    max_reduction=settings['max_reduction'],  # Fixed parameter name
+                    load_pixels=False,  # Pixels are decoded at export time only
+                    optimize_scale=settings['optimize_scale']
+                )
             
-            ### print(f"DEBUG: Generated {len(page_layouts)} pages")
-            ### for i, page in enumerate(page_layouts):
-                ### print(f"DEBUG: Page {i+1} has {len(page['images'])} images")
+            # Show layout in preview (the panel keeps the pages it received)
+            self.preview_panel.show_layout_preview(page_layouts)
             
-            # Store the layout - make a deep copy
-            self.current_page_layouts = copy.deepcopy(page_layouts)
+            # Store the layout - pages are immutable, so a tuple snapshot is enough
+            self.current_page_layouts = tuple(self.preview_panel.page_layouts)
+            self.laid_out_images = list(self.selected_images)
             ### print(f"DEBUG: Stored {len(self.current_page_layouts)} pages in current_page_layouts")
             
-            # Show layout in preview
-            self.preview_panel.show_layout_preview(self.current_page_layouts)
             self.update_export_button()
             
+            # Files that couldn't be read were left out of the layout
+            errors = self.page_layout.preparation_errors
+            if errors:
+                names = [os.path.basename(path) for path, _ in errors[:3]]
+                messagebox.showwarning(
+                    "Some images were skipped",
+                    f"Could not read: {', '.join(names)}\n\n{len(errors)} file(s) left out of the layout."
+                )
+            
         except Exception as e:
             print(f"DEBUG: Layout calculation error: {e}")
             self.preview_panel.show_error_message(str(e))
@@ -191,7 +238,11 @@ class MainWindow:
             success, message = self.document_exporter.export_document(
                 pages=self.current_page_layouts,
                 output_path=output_path,
-                format_type=format_type
+                format_type=format_type,
+                dpi=settings['dpi'],
+                resample=settings['resample'],
+                jpeg_quality=settings['jpeg_quality'],
+                compression=settings['compression']
             )
             
             if success:
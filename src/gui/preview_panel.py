@@ -50,16 +50,13 @@ class PreviewPanel:
     def show_layout_preview(self, page_layouts, scale_factor=0.2):
         
         ## Display page layouts in the preview panel
+        ## page_layouts: list of pages, or an iterator such as PageLayout.iter_pages;
+        ##               pages are drawn as soon as they are produced
         ## scale_factor: Scale down factor for preview (0.2 = 20% of actual size)
         
         self.clear_preview()
-        self.page_layouts = page_layouts
+        self.page_layouts = []
         
-        if not page_layouts:
-            self.canvas.create_text(200, 100, text="No layout to preview", 
-                                  fill="gray", font=("Arial", 12))
-            return
-            
         # Calculate total preview height
         page_width_px = 794  # A4 width in pixels at 96 DPI
         page_height_px = 1123  # A4 height in pixels at 96 DPI
@@ -71,6 +68,8 @@ class PreviewPanel:
         current_y = 20  # Start position
         
         for page_num, page in enumerate(page_layouts, 1):
+            self.page_layouts.append(page)
+            
             # Draw page background
             page_x = 20
             page_y = current_y
@@ -144,6 +143,15 @@ class PreviewPanel:
                     )
             
             current_y += preview_height + page_spacing + 30
+            
+            # Show this page while the next one is being packed
+            self.canvas.configure(scrollregion=(0, 0, preview_width + 100, current_y + 20))
+            self.canvas.update_idletasks()
+        
+        if not self.page_layouts:
+            self.canvas.create_text(200, 100, text="No layout to preview", 
+                                  fill="gray", font=("Arial", 12))
+            return
         
         # Update scroll region
         total_height = current_y + 20
@@ -14,8 +14,11 @@ class SettingsPanel:
             'spacing_mm': 3,
             'allow_rotation': True,
             'max_reduction': 0.25,  # 25% default
+            'optimize_scale': False,  # Shrink all images together if it saves pages
             'dpi': 96,
-            'jpeg_quality': 95
+            'resample': 'quality',  # 'quality' or 'fast' filter when images are resampled for the DPI
+            'jpeg_quality': 95,
+            'compression': 'auto'  # 'auto' (JPEG for photos, lossless for graphics) or 'lossless'
         }
         
     def setup_settings_ui(self):
@@ -68,15 +71,20 @@ class SettingsPanel:
         self.reduction_label = ttk.Label(reduction_frame, text="25%", width=5)
         self.reduction_label.pack(side=tk.RIGHT, padx=(5, 0))
         
+        # Page-saving shrink checkbox (uses the size reduction limit above)
+        self.optimize_scale_var = tk.BooleanVar(value=False)
+        optimize_scale_cb = ttk.Checkbutton(settings_frame, text="Shrink images to save pages", variable=self.optimize_scale_var, command=self.on_settings_change)
+        optimize_scale_cb.grid(row=5, column=0, columnspan=2, sticky=tk.W, pady=(10, 0))
+        
         # Advanced settings frame (collapsible)
         self.advanced_frame = ttk.LabelFrame(settings_frame, text="Advanced Settings", padding="5")
-        self.advanced_frame.grid(row=5, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(10, 0))
+        self.advanced_frame.grid(row=6, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(10, 0))
         self.advanced_frame.columnconfigure(1, weight=1)
         
         # Show/Hide advanced button
         self.advanced_visible = False
         self.advanced_btn = ttk.Button(settings_frame, text="Show Advanced Settings", command=self.toggle_advanced_settings)
-        self.advanced_btn.grid(row=6, column=0, columnspan=2, pady=(10, 0))
+        self.advanced_btn.grid(row=7, column=0, columnspan=2, pady=(10, 0))
         
         # Setup advanced settings (initially hidden)
         self.setup_advanced_settings()
@@ -105,6 +113,20 @@ class SettingsPanel:
         # Update quality label when scale changes
         quality_scale.configure(command=self.update_quality_label)
         
+        # Resampling filter used to bring images to the output DPI
+        ttk.Label(self.advanced_frame, text="Resampling:").grid(row=2, column=0, sticky=tk.W, pady=(5, 0))
+        self.resample_var = tk.StringVar(value="quality")
+        resample_combo = ttk.Combobox(self.advanced_frame, textvariable=self.resample_var, values=["quality", "fast"], state="readonly", width=10)
+        resample_combo.grid(row=2, column=1, sticky=tk.W, padx=(10, 0), pady=(5, 0))
+        resample_combo.bind('<<ComboboxSelected>>', self.on_settings_change)
+        
+        # Image compression: photos as JPEG at the quality above, or all lossless
+        ttk.Label(self.advanced_frame, text="Compression:").grid(row=3, column=0, sticky=tk.W, pady=(5, 0))
+        self.compression_var = tk.StringVar(value="auto")
+        compression_combo = ttk.Combobox(self.advanced_frame, textvariable=self.compression_var, values=["auto", "lossless"], state="readonly", width=10)
+        compression_combo.grid(row=3, column=1, sticky=tk.W, padx=(10, 0), pady=(5, 0))
+        compression_combo.bind('<<ComboboxSelected>>', self.on_settings_change)
+        
     def toggle_advanced_settings(self):
         # Toggle advanced settings visibility
         self.advanced_visible = not self.advanced_visible
@@ -137,8 +159,11 @@ class SettingsPanel:
                 'spacing_mm': int(self.spacing_var.get()),
                 'allow_rotation': self.rotation_var.get(),
                 'max_reduction': int(self.reduction_var.get()) / 100.0,  # Convert % to decimal
+                'optimize_scale': self.optimize_scale_var.get(),
                 'dpi': int(self.dpi_var.get()),
-                'jpeg_quality': int(self.quality_var.get())
+                'resample': self.resample_var.get(),
+                'jpeg_quality': int(float(self.quality_var.get())),  # Scale gives fractional values
+                'compression': self.compression_var.get()
             })
             
             # Validate margin and spacing values
@@ -176,9 +201,15 @@ class SettingsPanel:
             reduction_percent = int(new_settings['max_reduction'] * 100)
             self.reduction_var.set(reduction_percent)
             self.reduction_label.config(text=f"{reduction_percent}%")
+        if 'optimize_scale' in new_settings:
+            self.optimize_scale_var.set(new_settings['optimize_scale'])
         if 'dpi' in new_settings:
             self.dpi_var.set(str(new_settings['dpi']))
+        if 'resample' in new_settings:
+            self.resample_var.set(new_settings['resample'])
         if 'jpeg_quality' in new_settings:
             self.quality_var.set(str(new_settings['jpeg_quality']))
+        if 'compression' in new_settings:
+            self.compression_var.set(new_settings['compression'])
         
         self.on_settings_change()
\ No newline at end of file
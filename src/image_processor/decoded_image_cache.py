@@ -0,0 +1,97 @@
+import os
+import threading
+from collections import OrderedDict
+
+# In-memory cache of decoded images and image metadata for one session
+# Entries are keyed by the file fingerprint (path, size, mtime), so a file
+# changed on disk is read again. Decoded images are held up to a byte budget
+# and evicted least recently used first; metadata is tiny and kept by count.
+# Cached images are shared between callers and must be treated as read-only
+# (PIL operations such as rotate/resize return new images anyway).
+# Safe to use from the preparation thread pool.
+
+
+class DecodedImageCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_metadata=10000):
+        # max_bytes: memory budget for decoded pixels
+        # max_metadata: metadata entries kept
+        self.max_bytes = max_bytes
+        self.max_metadata = max_metadata
+        self._images = OrderedDict()    # key -> (image, bytes)
+        self._metadata = OrderedDict()  # fingerprint -> dict
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def fingerprint(self, image_path):
+        # Returns: (absolute path, size, mtime); raises OSError if the file is gone
+        stat = os.stat(image_path)
+        return (os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns)
+
+    def get_image(self, key):
+        # key: (fingerprint, variant), variant describing the transform applied
+        # Returns: cached PIL image, or None
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._images.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put_image(self, key, image):
+        size = image.width * image.height * len(image.getbands())
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._images.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous[1]
+            self._images[key] = (image, size)
+            self._total_bytes += size
+
+            while self._total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._images.popitem(last=False)
+                self._total_bytes -= evicted_size
+                self.evictions += 1
+
+    def get_metadata(self, fingerprint):
+        # Returns: cached metadata dict, or None
+        with self._lock:
+            metadata = self._metadata.get(fingerprint)
+            if metadata is not None:
+                self._metadata.move_to_end(fingerprint)
+            return metadata
+
+    def put_metadata(self, fingerprint, metadata):
+        with self._lock:
+            self._metadata[fingerprint] = metadata
+            self._metadata.move_to_end(fingerprint)
+            while len(self._metadata) > self.max_metadata:
+                self._metadata.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._metadata.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        # Returns: dict of counters for status display
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'images': len(self._images),
+                'metadata': len(self._metadata),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes
+            }
@@ -1,27 +1,128 @@
 from PIL import Image, ImageOps
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from image_processor.shared_pixels import start_transfer, share_image, attach_image, release_handle
+from image_processor.decoded_image_cache import DecodedImageCache
+
+# Modes Image.reduce() supports
+REDUCIBLE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'CMYK', 'I', 'F')
+
+# Layout coordinates are pixels at this resolution (A4 = 794 x 1123)
+LAYOUT_DPI = 96
+
+# Filters for the resample='...' arguments: 'fast' for drafts and huge
+# batches, 'quality' (default) for final output
+RESAMPLE_FAST = 'fast'
+RESAMPLE_QUALITY = 'quality'
+RESAMPLE_FILTERS = {
+    RESAMPLE_FAST: Image.Resampling.BILINEAR,
+    RESAMPLE_QUALITY: Image.Resampling.LANCZOS,
+}
+
+
+# Transforms kept queued per worker by render_batches: upcoming batches are
+# submitted until this many are waiting, so batches of one or two images
+# (small pages) still keep every worker busy
+RENDER_AHEAD_PER_WORKER = 2
+
+
+# Handler used by process-pool workers, set up once per worker by _init_worker
+_worker_handler = None
+
+
+def _init_worker(prepared_cache):
+    global _worker_handler
+    _worker_handler = ImageHandler(prepared_cache=prepared_cache)
+
+
+def _render_in_worker(args):
+    # Process-pool entry point for ImageHandler.render_many and render_batches
+    try:
+        return share_image(_worker_handler.render_image(*args))
+    except Exception as e:
+        return e
+
+
+def _prepare_in_worker(args):
+    # Process-pool entry point for ImageHandler.prepare_many (must be module level)
+    # Decoded pixels go back as a shared memory handle instead of being pickled
+    result = _worker_handler._prepare_or_error(*args)
+    if isinstance(result, dict) and result['image'] is not None:
+        try:
+            result['image'] = share_image(result['image'])
+        except Exception as e:
+            return e
+    return result
+
+
+def _collect_shared(results, handle_of):
+    # Drain a process-pool map whose results carry shared memory handles
+    # If the pool fails partway (e.g. BrokenProcessPool), the blocks of the
+    # results already received are freed before the error is raised
+    collected = []
+    try:
+        for result in results:
+            collected.append(result)
+    except Exception:
+        for result in collected:
+            handle = handle_of(result)
+            if handle is not None:
+                release_handle(handle)
+        raise
+    return collected
+
 
 class ImageHandler:
-    def __init__(self):
+    def __init__(self, workers=None, use_processes=False, prepared_cache=None, image_cache=None):
+        # workers: pool size for prepare_many (None = executor default, 1 = no pool)
+        # use_processes: prepare in a process pool instead of threads
+        # prepared_cache: optional PreparedImageCache used by render_image
+        # image_cache: DecodedImageCache for decoded images and metadata
+        #              (None = a new one for this handler); share the handler, or
+        #              the cache, so each file is read once per session
         self.supported_formats = ['.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff']
+        self.workers = workers
+        self.use_processes = use_processes
+        self.prepared_cache = prepared_cache
+        self.image_cache = image_cache if image_cache is not None else DecodedImageCache()
     
-    def load_image(self, image_path):
+    def load_image(self, image_path, min_size=None):
         # Load an image from file path
+        # min_size: (width, height) the caller needs; the image is decoded at the
+        #           smallest size that is still at least this big (None = full size)
         try:
             image = Image.open(image_path)
-            # Convert to RGB if necessary (for JPEG compatibility)
-            if image.mode in ('RGBA', 'P', 'LA'):
-                image = image.convert('RGB')
+            
+            # JPEG can scale by 1/2, 1/4 or 1/8 while decoding (DCT domain), so
+            # a large photo is never decoded at full resolution
+            if min_size and image.format == 'JPEG':
+                image.draft(image.mode, min_size)
+            
+            # Keep the native mode (1, L, P, LA, RGBA...): bilevel and palette
+            # scans stay at 1 byte per pixel and alpha reaches the PDF as a soft
+            # mask. Only palette transparency becomes a real alpha channel.
+            if image.mode == 'PA' or (image.mode == 'P' and 'transparency' in image.info):
+                image = image.convert('RGBA')
+            
+            # Other formats decode at full size: shrink by a whole factor
+            # (cheap box filter) so the final resample has less to do
+            if min_size and image.mode in REDUCIBLE_MODES:
+                factor = min(image.width // min_size[0], image.height // min_size[1])
+                if factor >= 2:
+                    image = image.reduce(factor)
+            
             return image
         except Exception as e:
             raise Exception(f"Error loading image {image_path}: {str(e)}")
     
     def get_image_info(self, image_path):
-        # Get basic information about an image
+        # Get basic information about an image (header only, cached)
         try:
-            image = self.load_image(image_path)
-            width, height = image.size
-            file_size = os.path.getsize(image_path) / 1024  # Size in KB
+            metadata = self.get_image_metadata(image_path)
+            width, height = metadata['width'], metadata['height']
+            file_size = metadata['file_size'] / 1024  # Size in KB
             
             return {
                 'path': image_path,
@@ -48,14 +149,40 @@ class ImageHandler:
         # Image is "too big" if either dimension exceeds threshold
         return width_ratio > threshold or height_ratio > threshold
         
-    def resize_image(self, image, max_width, max_height, max_reduction=0.25, threshold=0.6):
+    def resize_image(self, image, max_width, max_height, max_reduction=0.25, threshold=0.6, page_size=None):
         # Resize image while maintaining aspect ratio
         # Only resize if image occupies more than threshold% of available space
         # max_reduction: Maximum allowed size reduction (0.25 = 25%)
         # threshold: Only resize if image > threshold% of space (0.6 = 60%)
+        # page_size: (width, height) of the whole page, see calculate_resize_ratio
         # Returns: (resized_image, was_resized)
 
         original_width, original_height = image.size
+        scale_ratio = self.calculate_resize_ratio(
+            original_width, original_height, max_width, max_height, max_reduction, threshold, page_size
+        )
+        
+        # Only resize if needed and within allowed reduction
+        if scale_ratio < 1:
+            new_width = int(original_width * scale_ratio)
+            new_height = int(original_height * scale_ratio)
+            resized_image = self.resample_image(image, (new_width, new_height))
+            return resized_image, True
+        
+        return image, False
+    
+    def calculate_resize_ratio(self, original_width, original_height, max_width, max_height, max_reduction=0.25, threshold=0.6, page_size=None):
+        # Work out the scale resize_image would apply, from dimensions only
+        # page_size: (width, height) of the whole page; a source larger than the
+        #            page can't be printed at its own size, so it is always fitted
+        #            to the available space, whatever max_reduction allows
+        # Returns: scale ratio (1 means no resize)
+        
+        larger_than_page = page_size is not None and (
+            original_width > page_size[0] or original_height > page_size[1]
+        )
+        if larger_than_page:
+            return min(max_width / original_width, max_height / original_height)
         
         # Check if image is too big (occupies more than threshold)
         width_ratio = original_width / max_width
@@ -63,11 +190,11 @@ class ImageHandler:
         
         # Only resize if image exceeds threshold in either dimension
         if not (width_ratio > threshold or height_ratio > threshold):
-            return image, False  # Don't resize - image is not "too big"
+            return 1  # Don't resize - image is not "too big"
         
         # If max_reduction is 0, don't resize at all
         if max_reduction <= 0:
-            return image, False
+            return 1
         
         # Calculate scaling factors
         width_ratio = max_width / original_width
@@ -80,14 +207,26 @@ class ImageHandler:
         if scale_ratio < (1 - max_reduction):
             scale_ratio = 1 - max_reduction
         
-        # Only resize if needed and within allowed reduction
-        if scale_ratio < 1:
-            new_width = int(original_width * scale_ratio)
-            new_height = int(original_height * scale_ratio)
-            resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            return resized_image, True
+        return min(scale_ratio, 1)
+    
+    def resample_image(self, image, size, resample=Image.Resampling.LANCZOS):
+        # Resize keeping the image's mode where possible
+        # Pillow only resamples 1 and P images with nearest neighbour, which
+        # breaks up thin lines, so they are filtered as greyscale (1, grey
+        # palettes) or RGB mapped back onto the image's own palette
+        if image.mode == '1' or (image.mode == 'P' and self.has_grey_palette(image)):
+            return image.convert('L').resize(size, resample)
         
-        return image, False
+        if image.mode == 'P':
+            resized = image.convert('RGB').resize(size, resample)
+            return resized.quantize(palette=image, dither=Image.Dither.NONE)
+        
+        return image.resize(size, resample)
+    
+    def has_grey_palette(self, image):
+        # True for a P image whose palette holds only shades of grey
+        palette = image.getpalette() or []
+        return all(palette[i] == palette[i + 1] == palette[i + 2] for i in range(0, len(palette) - 2, 3))
     
     def rotate_image(self, image, allow_rotation=True):
         # Rotate image by 90 degrees if allowed
@@ -95,14 +234,21 @@ class ImageHandler:
         if not allow_rotation:
             return image, False
         
-        # Rotate 90 degrees clockwise
-        rotated_image = image.rotate(-90, expand=True)
+        # Rotate 90 degrees clockwise (a transpose: pixels are moved, not resampled)
+        rotated_image = image.transpose(Image.Transpose.ROTATE_270)
         return rotated_image, True
     
     def calculate_best_fit(self, image, container_width, container_height, allow_rotation=True):
         # Calculate whether image fits better in original or rotated orientation
         # Returns: (should_rotate, fit_ratio)
         original_width, original_height = image.size
+        return self.calculate_best_fit_for_size(
+            original_width, original_height, container_width, container_height, allow_rotation
+        )
+    
+    def calculate_best_fit_for_size(self, original_width, original_height, container_width, container_height, allow_rotation=True):
+        # Same as calculate_best_fit, but from dimensions only
+        # Returns: (should_rotate, fit_ratio)
         
         # Calculate fit ratio for original orientation
         width_ratio_orig = container_width / original_width
@@ -146,13 +292,314 @@ class ImageHandler:
         
         # Apply resizing if needed (with threshold check)
         image, was_resized = self.resize_image(
-            image, available_width, available_height, max_reduction, threshold
+            image, available_width, available_height, max_reduction, threshold, (page_width, page_height)
         )
         
         final_width, final_height = image.size
         
         return image, was_rotated, was_resized, final_width, final_height
     
+    def get_image_size(self, image_path):
+        # Read image dimensions from the file header without decoding pixels
+        try:
+            metadata = self.get_image_metadata(image_path)
+            return metadata['width'], metadata['height']
+        except Exception as e:
+            raise Exception(f"Error reading image size {image_path}: {str(e)}")
+    
+    def get_image_metadata(self, image_path):
+        # Header facts about an image file, read once per file version
+        # Returns: dict with width, height, mode, format and file_size (bytes)
+        fingerprint = self.image_cache.fingerprint(image_path)
+        metadata = self.image_cache.get_metadata(fingerprint)
+        if metadata is None:
+            with Image.open(image_path) as image:
+                metadata = {
+                    'width': image.width,
+                    'height': image.height,
+                    'mode': image.mode,
+                    'format': image.format,
+                    'file_size': fingerprint[1]
+                }
+            self.image_cache.put_metadata(fingerprint, metadata)
+        return metadata
+    
+    def probe_many(self, image_paths):
+        # get_image_metadata for many files on a thread pool (headers only;
+        # files already probed in their current version are answered from the cache)
+        # Returns: list in input order; an unreadable file gives an Exception
+        if len(image_paths) <= 1 or self.workers == 1:
+            return [self._probe_or_error(path) for path in image_paths]
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(self._probe_or_error, image_paths))
+    
+    def _probe_or_error(self, image_path):
+        try:
+            return self.get_image_metadata(image_path)
+        except Exception as e:
+            return Exception(f"Error reading image header {image_path}: {str(e)}")
+    
+    def plan_image_for_page(self, width, height, page_width, page_height, margin_mm, allow_rotation=True, max_reduction=0.25, threshold=0.6):
+        # Dimension-only version of prepare_image_for_page
+        # Nothing is decoded: rotation and scale are returned as a pending transform
+        # Returns: (was_rotated, was_resized, final_width, final_height, scale)
+        
+        margin_px = int(margin_mm * 3.78)
+        available_width = page_width - (2 * margin_px)
+        available_height = page_height - (2 * margin_px)
+        
+        should_rotate, fit_ratio = self.calculate_best_fit_for_size(
+            width, height, available_width, available_height, allow_rotation
+        )
+        
+        # Rotating 90 degrees swaps the dimensions
+        if should_rotate:
+            width, height = height, width
+        
+        scale = self.calculate_resize_ratio(
+            width, height, available_width, available_height, max_reduction, threshold, (page_width, page_height)
+        )
+        
+        if scale < 1:
+            return should_rotate, True, int(width * scale), int(height * scale), scale
+        
+        return should_rotate, False, width, height, 1
+    
+    def prepare_path(self, image_path, page_width, page_height, margin_mm, allow_rotation=True, max_reduction=0.25, load_pixels=True):
+        # Load (or only measure) one image file and prepare it for the page
+        # Returns: dict with the prepared size and the transform applied to reach it
+        # Plan from the header, so pixels can be decoded straight at the final size
+        source_width, source_height = self.get_image_size(image_path)
+        was_rotated, was_resized, width, height, scale = self.plan_image_for_page(
+            source_width, source_height, page_width, page_height, margin_mm,
+            allow_rotation, max_reduction
+        )
+        
+        if load_pixels:
+            prepared_image = self.render_image(image_path, was_rotated, width, height)
+            prepared_image.load()  # Decode here, not later on the caller's thread
+        else:
+            # Header-only: rotation and scale stay pending until render time
+            prepared_image = None
+        
+        return {
+            'original_path': image_path,
+            'image': prepared_image,
+            'width': width,
+            'height': height,
+            'was_rotated': was_rotated,
+            'was_resized': was_resized,
+            'source_width': source_width,
+            'source_height': source_height,
+            'scale': scale
+        }
+    
+    def prepare_many(self, image_paths, page_width, page_height, margin_mm, allow_rotation=True, max_reduction=0.25, load_pixels=True):
+        # prepare_path for many files on a worker pool (threads unless use_processes)
+        # Pillow releases the GIL while decoding and resampling, so threads scale;
+        # processes help when the Python-side work dominates (large TIFF/PNG batches)
+        # and hand pixels back through shared memory (see shared_pixels)
+        # Returns: list in input order; a failed file gives an Exception instead
+        #          of a dict, the rest of the batch still completes
+        tasks = [(path, page_width, page_height, margin_mm, allow_rotation, max_reduction, load_pixels)
+                 for path in image_paths]
+        
+        if not load_pixels:
+            # Header-only: read every header in one batch, the rest is arithmetic
+            self.probe_many(image_paths)
+            return [self._prepare_or_error(*task) for task in tasks]
+        
+        if len(tasks) <= 1 or self.workers == 1:
+            return [self._prepare_or_error(*task) for task in tasks]
+        
+        if self.use_processes:
+            start_transfer()
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                     initargs=(self.prepared_cache,)) as executor:
+                results = _collect_shared(executor.map(_prepare_in_worker, tasks, chunksize=4),
+                                          lambda result: result['image'] if isinstance(result, dict) else None)
+            return [self._attach_shared_image(result) for result in results]
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(lambda task: self._prepare_or_error(*task), tasks))
+    
+    def render_many(self, transforms, resample=RESAMPLE_QUALITY):
+        # render_image for many (path, rotated, width, height) transforms on the
+        # worker pool (threads unless use_processes, see prepare_many)
+        # Returns: list of images in input order; a failed render gives an Exception
+        tasks = [tuple(transform) + (resample,) for transform in transforms]
+        
+        if len(tasks) <= 1 or self.workers == 1:
+            return [self._render_or_error(*task) for task in tasks]
+        
+        if self.use_processes:
+            start_transfer()
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                     initargs=(self.prepared_cache,)) as executor:
+                results = _collect_shared(executor.map(_render_in_worker, tasks),
+                                          lambda result: None if isinstance(result, Exception) else result)
+            return [result if isinstance(result, Exception) else attach_image(result) for result in results]
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(lambda task: self._render_or_error(*task), tasks))
+    
+    def render_batches(self, batches, resample=RESAMPLE_QUALITY):
+        # render_many for a stream of batches (e.g. the images of each page) on
+        # one pool kept open for the whole stream; the transforms of upcoming
+        # batches are rendered ahead while the caller handles the current one
+        # batches: iterable of (item, transforms), consumed lazily
+        # Yields: (item, list of images in input order; a failed render gives
+        #          an Exception), in batch order
+        if self.workers == 1:
+            for item, transforms in batches:
+                yield item, [self._render_or_error(*transform, resample) for transform in transforms]
+            return
+        
+        if self.use_processes:
+            start_transfer()
+            workers = self.workers or os.cpu_count() or 1
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                           initargs=(self.prepared_cache,))
+            render = _render_in_worker
+        else:
+            workers = self.workers or min(32, (os.cpu_count() or 1) + 4)  # ThreadPoolExecutor's default
+            executor = ThreadPoolExecutor(max_workers=workers)
+            render = lambda task: self._render_or_error(*task)
+        window = workers * RENDER_AHEAD_PER_WORKER
+        
+        pending = deque()  # (item, futures), oldest first
+        try:
+            queued = 0
+            batches = iter(batches)
+            more_batches = True
+            while True:
+                while more_batches and (not pending or queued < window):
+                    batch = next(batches, None)
+                    if batch is None:
+                        more_batches = False
+                        break
+                    item, transforms = batch
+                    futures = [executor.submit(render, tuple(transform) + (resample,)) for transform in transforms]
+                    pending.append((item, futures))
+                    queued += len(futures)
+                
+                if not pending:
+                    return
+                item, futures = pending[0]
+                results = [self._received_render(future.result()) for future in futures]
+                pending.popleft()
+                queued -= len(futures)
+                yield item, results
+        finally:
+            # Stopped early (or failed): drop the queued work, and free the
+            # shared blocks of renders that finished but were never attached
+            for _, futures in pending:
+                for future in futures:
+                    future.cancel()
+            executor.shutdown(wait=True)
+            if self.use_processes:
+                for _, futures in pending:
+                    for future in futures:
+                        if future.cancelled() or future.exception() is not None:
+                            continue
+                        result = future.result()
+                        if not isinstance(result, (Exception, Image.Image)):
+                            release_handle(result)
+    
+    def _received_render(self, result):
+        # A render_batches result as the caller gets it: process-pool renders
+        # arrive as shared memory handles
+        if isinstance(result, (Exception, Image.Image)):
+            return result
+        try:
+            return attach_image(result)
+        except Exception as e:
+            return Exception(f"Error receiving rendered image: {str(e)}")
+    
+    def _render_or_error(self, image_path, *args):
+        try:
+            return self.render_image(image_path, *args)
+        except Exception as e:
+            return e
+    
+    def _prepare_or_error(self, image_path, *args):
+        # Errors are returned, not raised, so one bad file doesn't stop the batch
+        try:
+            return self.prepare_path(image_path, *args)
+        except Exception as e:
+            return e
+    
+    def _attach_shared_image(self, result):
+        # Swap a worker's shared memory handle for the image mapped over it
+        if not isinstance(result, dict) or result['image'] is None:
+            return result
+        try:
+            result['image'] = attach_image(result['image'])
+        except Exception as e:
+            return Exception(f"Error receiving prepared image {result['original_path']}: {str(e)}")
+        return result
+    
+    def print_size(self, width, height, dpi, source_size=None):
+        # Pixels needed to print a placement of width x height layout pixels at
+        # dpi, never more than the source has (source_size in placed orientation)
+        # Returns: (width, height) in pixels
+        factor = dpi / LAYOUT_DPI
+        if source_size is not None:
+            factor = min(factor, source_size[0] / width, source_size[1] / height)
+        return max(1, round(width * factor)), max(1, round(height * factor))
+    
+    def render_image(self, image_path, rotated=False, width=None, height=None, resample=RESAMPLE_QUALITY, keep=True):
+        # Apply a pending transform recorded by plan_image_for_page
+        # rotated: rotate 90 degrees clockwise; width/height: final size in pixels
+        # resample: RESAMPLE_QUALITY or RESAMPLE_FAST
+        # keep: hold the result in the memory and disk caches; False for one-off
+        #       renders (export), so the pixels are freed as soon as the caller
+        #       drops them and no uncompressed copy is written to disk (export
+        #       caches its encoded data instead, see DocumentExporter)
+        # Returns: the decoded, transformed image (may be shared: don't modify it)
+        try:
+            memory_key = (self.image_cache.fingerprint(image_path),
+                          ('render', bool(rotated), width, height, resample))
+        except OSError:
+            memory_key = None  # load_image reports the error
+        if memory_key is not None:
+            image = self.image_cache.get_image(memory_key)
+            if image is not None:
+                return image
+        
+        cache_key = None
+        if self.prepared_cache is not None:
+            cache_key = self.prepared_cache.make_key(image_path, rotated, width, height, resample)
+            image = self.prepared_cache.get(cache_key)
+            if image is not None:
+                if memory_key is not None and keep:
+                    self.image_cache.put_image(memory_key, image)
+                return image
+        
+        # The whole transform is applied in one go: decode at reduced size
+        # (JPEG draft / reduce), one resample in the source orientation, then a
+        # 90 degree turn, which only moves pixels (exact, no second resample)
+        # and is cheapest on the already resized image
+        source_size = None
+        if width and height:
+            source_size = (height, width) if rotated else (width, height)
+        image = self.load_image(image_path, source_size)
+        
+        if source_size and image.size != source_size:
+            image = self.resample_image(image, source_size, RESAMPLE_FILTERS[resample])
+        
+        if rotated:
+            image, _ = self.rotate_image(image, True)
+        
+        image.load()
+        if memory_key is not None and keep:
+            self.image_cache.put_image(memory_key, image)
+        if cache_key is not None and width and height and keep:
+            self.prepared_cache.put(cache_key, image)
+        
+        return image
+    
     def is_supported_format(self, file_path):
         # Check if file format is supported
         ext = os.path.splitext(file_path)[1].lower()
@@ -0,0 +1,190 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+from PIL import Image
+
+# On-disk cache of prepared (decoded, rotated, resized) images
+# Keys combine the source fingerprint (path, size, mtime) with the transform
+# (rotation, final size, resample filter), so an edited file or a different
+# placement never gets a stale bitmap. Entries are raw pixel blobs, which
+# load much faster than decoding and resampling the source again; export
+# stores its encoded image data instead (put_encoded), which is compact and
+# saves the compression as well. Total size
+# is kept under a byte budget; the least recently used files go first (file
+# mtime is touched on every hit). Several processes and threads may share a
+# directory: each write goes to its own temp file and is moved into place.
+
+
+class PreparedImageCache:
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        # cache_dir: directory for the cache files
+        # max_bytes: disk budget for all entries together
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()  # Counters and eviction; render pools call from threads
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+
+    def __getstate__(self):
+        # Process-pool workers get the cache as an initializer argument, and a
+        # lock can't be pickled (spawn/forkserver): each copy makes its own
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def make_key(self, image_path, rotated, width, height, resample='quality'):
+        # Build the cache key for one transform of one file
+        # Returns: key tuple, or None if the file can't be read (don't cache)
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        return (os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns,
+                bool(rotated), width, height, resample)
+
+    def get(self, key):
+        # Returns: the cached PIL image, or None
+        entry = self._load(key)
+        if entry is None:
+            return None
+
+        mode, size, palette, data = entry
+        image = Image.frombytes(mode, size, data)
+        if palette is not None:
+            image.putpalette(palette)
+        return image
+
+    def put(self, key, image):
+        palette = image.getpalette() if image.mode == 'P' else None
+        self._store(key, (image.mode, image.size, palette, image.tobytes()))
+
+    def get_encoded(self, key):
+        # Returns: the entry stored by put_encoded, or None
+        return self._load(key)
+
+    def put_encoded(self, key, entry):
+        # entry: picklable encoded image data (see CompressionPolicy.cache_entry);
+        #        key should tell it apart from the pixel entry of the same transform
+        self._store(key, entry)
+
+    def _load(self, key):
+        if key is None:
+            return None
+
+        path = self._file_path(key)
+        try:
+            with open(path, 'rb') as f:
+                stored_key, entry = pickle.load(f)
+            if stored_key != key:
+                self._count_miss()
+                return None
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            self._count_miss()
+            return None
+        except Exception as e:
+            print(f"DEBUG: Ignoring unreadable image cache file {path}: {e}")
+            self._count_miss()
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def _store(self, key, entry):
+        if key is None:
+            return
+
+        path = self._file_path(key)
+        temp_path = None
+        try:
+            # Unique temp file per write, so concurrent writers never share one
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((key, entry), f, protocol=pickle.HIGHEST_PROTOCOL)
+            with self._lock:
+                # An entry written again (same key from another thread) is
+                # replaced, not added
+                try:
+                    previous_size = os.path.getsize(path)
+                except OSError:
+                    previous_size = 0
+                size = os.path.getsize(temp_path)
+                os.replace(temp_path, path)
+                self._total_bytes += size - previous_size
+                if self._total_bytes > self.max_bytes:
+                    self._evict()
+        except Exception as e:
+            print(f"DEBUG: Could not write image cache file {path}: {e}")
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def clear(self):
+        with self._lock:
+            for _, _, path in self._entries():
+                os.remove(path)
+            self._total_bytes = 0
+
+    def stats(self):
+        # Returns: dict of counters for status display
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+    def _count_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def _file_path(self, key):
+        digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.pixels')
+
+    def _entries(self):
+        # Returns: list of (mtime, size, path), oldest first
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pixels'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # Removed by another process
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    def _evict(self):
+        # Drop least recently used files until the cache is within budget
+        # The directory is rescanned so other processes' files are counted too
+        # Called with self._lock held
+        entries = self._entries()
+        self._total_bytes = sum(size for _, size, _ in entries)
+
+        for _, size, path in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._total_bytes -= size
+            self.evictions += 1
@@ -0,0 +1,109 @@
+from multiprocessing import resource_tracker, shared_memory
+
+from PIL import Image
+
+# Pixel transfer between processes through shared memory
+# A worker copies a decoded image into a named shared memory block and sends
+# back only a small handle; the parent maps the block as the pixel buffer of
+# a new image, so the bitmap is never pickled or copied on arrival.
+# Modes Pillow can map in place, with their bytes per pixel (RGB is stored
+# 4 bytes per pixel internally); other modes are copied once on arrival.
+MAPPED_MODES = {
+    'RGB': 4,
+    'RGBA': 4,
+    'L': 1,
+    'P': 1,
+    'CMYK': 4,
+    'I;16': 2,
+}
+
+
+def start_transfer():
+    # Call in the parent before starting worker processes
+    # Workers must share the parent's resource tracker: otherwise each worker
+    # starts its own, which unlinks the worker's blocks as soon as it exits,
+    # before the parent has attached them
+    resource_tracker.ensure_running()
+
+
+def share_image(image):
+    # Worker side: copy image pixels into a new shared memory block
+    # The block is left for the parent to unlink (attach_image)
+    # Returns: handle tuple (block name, mode, size, palette, info)
+    image.load()
+    mode = image.mode
+    width, height = image.size
+    palette = image.getpalette() if mode == 'P' else None
+
+    if mode in MAPPED_MODES:
+        data = None
+        size = width * height * MAPPED_MODES[mode]
+    else:
+        data = image.tobytes('raw', mode)
+        size = len(data)
+
+    block = shared_memory.SharedMemory(create=True, size=max(1, size))
+    try:
+        if data is None:
+            # Write straight into the block through a mapped image, no
+            # intermediate bytes object (the core paste ignores read-only)
+            target = _map_image(mode, image.size, block.buf)
+            target.im.paste(image.im, (0, 0) + image.size)
+            del target
+        else:
+            block.buf[:size] = data
+    except Exception:
+        block.close()
+        block.unlink()
+        raise
+
+    handle = (block.name, mode, image.size, palette, dict(image.info))
+    block.close()
+    return handle
+
+
+def attach_image(handle):
+    # Parent side: rebuild the image from a share_image handle
+    # Mapped modes keep using the shared block as pixel memory: the image's
+    # buffer holds the block's mapping, which is unmapped when the image is
+    # released. The block object itself is closed right away; closing it later
+    # (e.g. at interpreter exit) would fail while the image still exports its
+    # buffer. Its name is unlinked right away so nothing leaks if the image is
+    # never freed cleanly.
+    # Returns: PIL image (read-only for mapped modes; Pillow copies on write)
+    name, mode, size, palette, info = handle
+    block = shared_memory.SharedMemory(name=name)
+    block.unlink()
+
+    if mode in MAPPED_MODES:
+        mapping, block._mmap = block._mmap, None  # Owned by the image from here on
+        block.close()
+        image = _map_image(mode, size, mapping)
+    else:
+        image = Image.frombuffer(mode, size, block.buf, 'raw', mode, 0, 1)
+        block.close()
+
+    if palette is not None:
+        image.putpalette(palette)
+    image.info.update(info)
+    return image
+
+
+def release_handle(handle):
+    # Free a block whose image will never be attached (batch aborted)
+    try:
+        block = shared_memory.SharedMemory(name=handle[0])
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
+
+
+def _map_image(mode, size, buffer):
+    # Image.frombuffer only maps RGB as RGBX, so RGB goes through the core
+    # directly (same 4-byte pixel layout) to keep the mode the caller sent
+    if mode == 'RGB':
+        image = Image.new(mode, (0, 0))._new(Image.core.map_buffer(buffer, size, 'raw', 0, (mode, 0, 1)))
+        image.readonly = 1
+        return image
+    return Image.frombuffer(mode, size, buffer, 'raw', mode, 0, 1)
@@ -0,0 +1,112 @@
+import bisect
+
+# Free-space index for the guillotine packer
+# Rectangles are (x, y, width, height) tuples in page pixels.
+# A view sorted by position (y, x) answers fit queries top-left first: the
+# scan stops at the first rectangle that fits instead of ranking them all.
+# Edge dictionaries find merge partners in O(1), so adjacent rectangles are
+# merged as they are added instead of by a full rescan after every placement.
+
+
+class FreeRectangleIndex:
+    def __init__(self, rectangles=()):
+        self._rectangles = set()
+        self._by_position = []  # sorted (y, x, width, height)
+
+        # Edge keys -> set of rectangles having that edge
+        self._tops = {}     # (x, width, top)
+        self._bottoms = {}  # (x, width, bottom)
+        self._lefts = {}    # (y, height, left)
+        self._rights = {}   # (y, height, right)
+
+        for rect in rectangles:
+            self.add(rect)
+
+    def __len__(self):
+        return len(self._rectangles)
+
+    def __iter__(self):
+        # Iterate top-left first, like the packer's placement order
+        for y, x, w, h in self._by_position:
+            yield (x, y, w, h)
+
+    def __contains__(self, rect):
+        return rect in self._rectangles
+
+    def add(self, rect):
+        # Add a free rectangle, merging it with any exactly adjacent neighbour
+        # of the same width (vertically) or height (horizontally)
+        x, y, w, h = rect
+        if w <= 0 or h <= 0 or rect in self._rectangles:
+            return
+
+        while True:
+            neighbour = self._find_merge_partner(rect)
+            if neighbour is None:
+                break
+
+            self._discard(neighbour)
+            nx, ny, nw, nh = neighbour
+            if nx == x and nw == w:
+                rect = (x, min(y, ny), w, h + nh)
+            else:
+                rect = (min(x, nx), y, w + nw, h)
+            x, y, w, h = rect
+
+            if rect in self._rectangles:
+                return
+
+        self._insert(rect)
+
+    # list-style alias so the index can stand in for the old list of rectangles
+    append = add
+
+    def remove(self, rect):
+        if rect not in self._rectangles:
+            raise ValueError(f"Free rectangle not in index: {rect}")
+        self._discard(rect)
+
+    def find_top_left(self, width, height):
+        # Topmost, then leftmost rectangle that fits width x height
+        for y, x, w, h in self._by_position:
+            if width <= w and height <= h:
+                return (x, y, w, h)
+        return None
+
+    def _find_merge_partner(self, rect):
+        x, y, w, h = rect
+        for edges, key in ((self._bottoms, (x, w, y)),       # above
+                           (self._tops, (x, w, y + h)),      # below
+                           (self._rights, (y, h, x)),        # left
+                           (self._lefts, (y, h, x + w))):    # right
+            candidates = edges.get(key)
+            if candidates:
+                return next(iter(candidates))
+        return None
+
+    def _insert(self, rect):
+        x, y, w, h = rect
+        self._rectangles.add(rect)
+        bisect.insort(self._by_position, (y, x, w, h))
+        self._tops.setdefault((x, w, y), set()).add(rect)
+        self._bottoms.setdefault((x, w, y + h), set()).add(rect)
+        self._lefts.setdefault((y, h, x), set()).add(rect)
+        self._rights.setdefault((y, h, x + w), set()).add(rect)
+
+    def _discard(self, rect):
+        x, y, w, h = rect
+        self._rectangles.discard(rect)
+        self._remove_sorted(self._by_position, (y, x, w, h))
+        for edges, key in ((self._tops, (x, w, y)),
+                           (self._bottoms, (x, w, y + h)),
+                           (self._lefts, (y, h, x)),
+                           (self._rights, (y, h, x + w))):
+            candidates = edges[key]
+            candidates.discard(rect)
+            if not candidates:
+                del edges[key]
+
+    def _remove_sorted(self, items, item):
+        index = bisect.bisect_left(items, item)
+        if index < len(items) and items[index] == item:
+            items.pop(index)
@@ -0,0 +1,132 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+# Cache of finished layouts
+# Keys combine a fingerprint of every image (path, size, mtime) in order with
+# the layout settings, so an edited or replaced file is never served stale.
+# Tier 1 is an in-memory LRU; tier 2 (optional) is a directory of pickles that
+# survives restarts. Only dimension-only layouts (image=None) are cached;
+# pages are immutable, so they are shared rather than copied.
+
+
+class LayoutCache:
+    def __init__(self, max_entries=32, cache_dir=None, max_disk_entries=256):
+        # max_entries: layouts kept in memory
+        # cache_dir: directory for the on-disk tier (None = memory only)
+        # max_disk_entries: files kept on disk, least recently used removed first
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, image_paths, margin_mm, spacing_mm, allow_rotation, max_reduction, strategy, heuristic=None,
+                 optimize_scale=False):
+        # Build the cache key for a layout request
+        # Returns: key tuple, or None if a file can't be read (don't cache)
+        fingerprints = []
+        for path in image_paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            fingerprints.append((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+
+        return (tuple(fingerprints), margin_mm, spacing_mm, bool(allow_rotation),
+                max_reduction, strategy, heuristic, bool(optimize_scale))
+
+    def get(self, key):
+        # Returns: list of the cached pages, or None
+        if key is None:
+            return None
+
+        pages = self._memory.get(key)
+        if pages is not None:
+            self._memory.move_to_end(key)
+        else:
+            pages = self._load_from_disk(key)
+            if pages is not None:
+                self._remember(key, pages)
+
+        if pages is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return list(pages)
+
+    def put(self, key, pages):
+        # Store a finished layout (placements must not hold decoded images)
+        if key is None or any(img.get('image') is not None for page in pages for img in page['images']):
+            return
+
+        pages = tuple(pages)
+        self._remember(key, pages)
+        self._save_to_disk(key, pages)
+
+    def clear(self):
+        self._memory.clear()
+        if self.cache_dir:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.layout'):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def _remember(self, key, pages):
+        self._memory[key] = pages
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_path(self, key):
+        digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.layout')
+
+    def _load_from_disk(self, key):
+        if not self.cache_dir:
+            return None
+
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                stored_key, pages = pickle.load(f)
+            if stored_key != key:
+                return None
+            os.utime(path)  # Mark as recently used
+            return pages
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"DEBUG: Ignoring unreadable layout cache file {path}: {e}")
+            return None
+
+    def _save_to_disk(self, key, pages):
+        if not self.cache_dir:
+            return
+
+        path = self._disk_path(key)
+        temp_path = path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump((key, pages), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+            self._prune_disk()
+        except Exception as e:
+            print(f"DEBUG: Could not write layout cache file {path}: {e}")
+
+    def _prune_disk(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.layout'):
+                full_path = os.path.join(self.cache_dir, name)
+                entries.append((os.path.getmtime(full_path), full_path))
+
+        entries.sort()
+        for _, full_path in entries[:max(0, len(entries) - self.max_disk_entries)]:
+            os.remove(full_path)
@@ -0,0 +1,105 @@
+# Immutable layout model
+# A layout is a tuple of Page objects, each holding a tuple of Placement
+# objects. Both use __slots__ and can't be modified after creation, so a
+# layout can be shared or snapshotted without copying (no deepcopy of the
+# decoded bitmaps). Both also offer a read-only dict-style view (page['images'],
+# img['x'], img.get('rotated')) for code written against the old dict format.
+
+
+class Placement:
+    __slots__ = ('original_path', 'x', 'y', 'width', 'height',
+                 'rotated', 'resized', 'scale', 'image')
+
+    def __init__(self, original_path, x, y, width, height, rotated=False, resized=False, scale=1.0, image=None):
+        # original_path: source file, the handle used to decode pixels lazily
+        # x, y, width, height: placed box on the page in pixels (96 DPI)
+        # rotated: turned 90 degrees clockwise relative to the source file
+        # scale: placed size / source size
+        # image: decoded PIL image already at the placed size, or None
+        for name, value in zip(self.__slots__,
+                               (original_path, x, y, width, height, rotated, resized, scale, image)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Placement is immutable, use replace()")
+
+    def __delattr__(self, name):
+        raise AttributeError("Placement is immutable, use replace()")
+
+    def __reduce__(self):
+        return (Placement, tuple(getattr(self, name) for name in self.__slots__))
+
+    def __eq__(self, other):
+        if not isinstance(other, Placement):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return (f"Placement({self.original_path!r}, x={self.x}, y={self.y}, "
+                f"width={self.width}, height={self.height}, rotated={self.rotated})")
+
+    def replace(self, **changes):
+        # Copy with some fields changed
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(changes)
+        return Placement(**values)
+
+    # Read-only dict-style view
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def keys(self):
+        return self.__slots__
+
+
+class Page:
+    __slots__ = ('page_number', 'images')
+
+    def __init__(self, page_number, images=()):
+        object.__setattr__(self, 'page_number', page_number)
+        object.__setattr__(self, 'images', tuple(images))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Page is immutable, use replace()")
+
+    def __delattr__(self, name):
+        raise AttributeError("Page is immutable, use replace()")
+
+    def __reduce__(self):
+        return (Page, (self.page_number, self.images))
+
+    def __eq__(self, other):
+        if not isinstance(other, Page):
+            return NotImplemented
+        return self.page_number == other.page_number and self.images == other.images
+
+    def __repr__(self):
+        return f"Page({self.page_number}, {len(self.images)} images)"
+
+    def replace(self, **changes):
+        values = {'page_number': self.page_number, 'images': self.images}
+        values.update(changes)
+        return Page(**values)
+
+    # Read-only dict-style view
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def keys(self):
+        return self.__slots__
@@ -0,0 +1,171 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from layout.max_rects import HEURISTICS, BEST_SHORT_SIDE_FIT
+
+# Sort keys tried by the search; images are packed in descending key order
+# 'max_side' is the order calculate_layout uses on its own
+ORDERINGS = {
+    'max_side': lambda img: (max(img['width'], img['height']), img['width'] * img['height']),
+    'area': lambda img: (img['width'] * img['height'], max(img['width'], img['height'])),
+    'height': lambda img: (img['height'], img['width']),
+    'width': lambda img: (img['width'], img['height']),
+    'perimeter': lambda img: (img['width'] + img['height'], img['width'] * img['height']),
+    'aspect': lambda img: (max(img['width'], img['height']) / max(1, min(img['width'], img['height'])),
+                           img['width'] * img['height']),
+}
+
+# Packing engines: guillotine plus MaxRects with every heuristic
+# The guillotine packer never rotates, so it is only paired with the first
+# rotation policy
+ENGINES = [('maxrects', heuristic) for heuristic in HEURISTICS] + [('guillotine', None)]
+
+# Rotation policies: let the packer turn images, or keep the prepared orientation
+ROTATION_POLICIES = ('packer', 'prepared')
+
+
+def layout_score(pages, usable_area):
+    # Rank a layout: fewer pages first, then higher area utilisation, then the
+    # emptiest last page (the same images squeezed onto the earlier pages)
+    # Returns: tuple, lower is better
+    if not pages:
+        return (0, 0, 0)
+
+    placed_area = sum(img['width'] * img['height'] for page in pages for img in page['images'])
+    last_page_area = sum(img['width'] * img['height'] for img in pages[-1]['images'])
+    utilisation = placed_area / (len(pages) * usable_area)
+
+    return (len(pages), -utilisation, last_page_area)
+
+
+def _evaluate_candidate(prepared_images, geometry, candidate):
+    # Pack one (ordering, engine, rotation policy) combination
+    # Runs in a worker process, so it only receives picklable dimension data
+    # Returns: (score, candidate, pages)
+    from layout.page_layout import PageLayout
+
+    ordering, (engine, heuristic), rotation_policy = candidate
+    available_width, available_height, margin_px, spacing_px, allow_rotation = geometry
+
+    images = sorted(prepared_images, key=ORDERINGS[ordering], reverse=True)
+    page_layout = PageLayout()
+
+    if engine == 'guillotine':
+        pages = list(page_layout._iter_pack_images(images, available_width, available_height,
+                                                   margin_px, spacing_px))
+    else:
+        packer_rotation = allow_rotation and rotation_policy == 'packer'
+        pages = page_layout._pack_images_maxrects(images, available_width, available_height,
+                                                  margin_px, spacing_px, packer_rotation, heuristic)
+
+    return layout_score(pages, available_width * available_height), candidate, pages
+
+
+class LayoutSearch:
+    def __init__(self, time_budget=2.0, workers=None, orderings=None, engines=None, rotation_policies=None):
+        # time_budget: wall-clock seconds to wait for candidates before taking the best so far
+        # workers: process count (None = os.cpu_count())
+        self.time_budget = time_budget
+        self.workers = workers
+        self.orderings = list(orderings or ORDERINGS)
+        self.engines = list(engines or ENGINES)
+        self.rotation_policies = list(rotation_policies or ROTATION_POLICIES)
+
+        # Details of the most recent search, for status display
+        self.last_result = None
+
+    def candidates(self, allow_rotation=True):
+        # All combinations to try, the default calculate_layout combination first
+        policies = self.rotation_policies if allow_rotation else self.rotation_policies[:1]
+        candidates = [(ordering, engine, policy)
+                      for ordering in self.orderings
+                      for engine in self.engines
+                      for policy in (policies if engine[0] != 'guillotine' else policies[:1])]
+
+        default = ('max_side', ('maxrects', BEST_SHORT_SIDE_FIT), policies[0])
+        if default in candidates:
+            candidates.remove(default)
+            candidates.insert(0, default)
+
+        return candidates
+
+    def search(self, prepared_images, available_width, available_height, margin_px, spacing_px, allow_rotation=True):
+        # Run every candidate in a process pool and keep the best layout
+        # finished within the time budget (at least one candidate always completes)
+        # prepared_images: dimension-only entries from PageLayout._prepare_images
+        # Returns: List of pages
+        start = time.perf_counter()
+        geometry = (available_width, available_height, margin_px, spacing_px, allow_rotation)
+        candidates = self.candidates(allow_rotation)
+
+        try:
+            results = self._search_parallel(prepared_images, geometry, candidates, start)
+        except (OSError, RuntimeError, NotImplementedError) as e:
+            # No process support (restricted environment): search in this process
+            print(f"DEBUG: Parallel layout search unavailable, running sequentially: {e}")
+            results = self._search_sequential(prepared_images, geometry, candidates, start)
+
+        # Ties go to the earlier candidate, so completion order doesn't matter
+        score, candidate, pages = min(results, key=lambda result: (result[0], candidates.index(result[1])))
+
+        self.last_result = {
+            'ordering': candidate[0],
+            'strategy': candidate[1][0],
+            'heuristic': candidate[1][1],
+            'rotation_policy': candidate[2],
+            'total_pages': score[0],
+            'utilisation': -score[1],
+            'candidates_tried': len(results),
+            'candidates_total': len(candidates),
+            'elapsed_seconds': time.perf_counter() - start
+        }
+
+        return pages
+
+    def _search_parallel(self, prepared_images, geometry, candidates, start):
+        results = []
+        pending = set()
+        executor = ProcessPoolExecutor(max_workers=self.workers or os.cpu_count())
+        try:
+            pending = {executor.submit(_evaluate_candidate, prepared_images, geometry, candidate)
+                       for candidate in candidates}
+
+            while pending:
+                remaining = self.time_budget - (time.perf_counter() - start)
+                if remaining <= 0 and results:
+                    break
+
+                # Past the budget with nothing finished yet: wait for the first result
+                timeout = remaining if remaining > 0 else None
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        print(f"DEBUG: Layout candidate failed: {e}")
+        finally:
+            # Don't block the caller on candidates that are still running, and
+            # don't leave them using the CPU after the budget: stop the workers
+            processes = list((getattr(executor, '_processes', None) or {}).values())
+            executor.shutdown(wait=False, cancel_futures=True)
+            if pending:
+                for process in processes:
+                    if process.is_alive():
+                        process.terminate()
+                for process in processes:
+                    process.join(timeout=1.0)
+
+        if not results:
+            raise RuntimeError("No layout candidate completed")
+
+        return results
+
+    def _search_sequential(self, prepared_images, geometry, candidates, start):
+        results = []
+        for candidate in candidates:
+            if results and time.perf_counter() - start >= self.time_budget:
+                break
+            results.append(_evaluate_candidate(prepared_images, geometry, candidate))
+        return results
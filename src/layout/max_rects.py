@@ -0,0 +1,255 @@
+# MaxRects bin packing for a single page
+# Free space is kept as a list of maximal (possibly overlapping) rectangles.
+# After every placement each intersected free rectangle is split into up to
+# four maximal pieces and rectangles contained in another one are pruned.
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, find_best falls back to pure Python
+    np = None
+
+BEST_SHORT_SIDE_FIT = 'best_short_side_fit'
+BEST_LONG_SIDE_FIT = 'best_long_side_fit'
+BEST_AREA_FIT = 'best_area_fit'
+BOTTOM_LEFT = 'bottom_left'
+CONTACT_POINT = 'contact_point'
+
+HEURISTICS = (
+    BEST_SHORT_SIDE_FIT,
+    BEST_LONG_SIDE_FIT,
+    BEST_AREA_FIT,
+    BOTTOM_LEFT,
+    CONTACT_POINT,
+)
+
+
+class MaxRectsBin:
+    def __init__(self, x, y, width, height, heuristic=BEST_SHORT_SIDE_FIT):
+        # x, y, width, height: usable area of the page in pixels
+        # heuristic: one of HEURISTICS, decides which free position wins
+        if heuristic not in HEURISTICS:
+            raise ValueError(f"Unknown MaxRects heuristic: {heuristic}")
+
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.heuristic = heuristic
+
+        self.free_rectangles = [(x, y, width, height)]
+        self.used_rectangles = []
+
+    def find_position(self, width, height, allow_rotation=False):
+        # Find the best free position for a width x height rectangle
+        # Returns: (score, x, y, rotated) or None if it doesn't fit anywhere
+        # Lower scores are better
+        best = None
+
+        orientations = [(width, height, False)]
+        if allow_rotation and width != height:
+            orientations.append((height, width, True))
+
+        for w, h, rotated in orientations:
+            for rx, ry, rw, rh in self.free_rectangles:
+                if w > rw or h > rh:
+                    continue
+
+                score = self._score(rx, ry, rw, rh, w, h)
+                if best is None or score < best[0]:
+                    best = (score, rx, ry, rotated)
+
+        return best
+
+    def find_best(self, sizes, allow_rotation=False):
+        # Best position over several candidate rectangles at once
+        # sizes: sequence (or NumPy array) of (width, height)
+        # Returns: (index, score, x, y, rotated) or None if nothing fits
+        # Ties go to the earliest size, then unrotated, then earliest free rectangle
+        if len(sizes) == 0 or not self.free_rectangles:
+            return None
+        
+        if np is not None:
+            return self._find_best_vectorized(sizes, allow_rotation)
+        
+        best = None
+        for index, (width, height) in enumerate(sizes):
+            position = self.find_position(width, height, allow_rotation)
+            if position and (best is None or position[0] < best[1]):
+                best = (index,) + position
+        return best
+
+    def _find_best_vectorized(self, sizes, allow_rotation):
+        # Evaluate every (size, orientation, free rectangle) triple in one broadcast
+        sizes = np.asarray(sizes, dtype=np.int64).reshape(-1, 2)
+        free = np.asarray(self.free_rectangles, dtype=np.int64)
+        rx, ry, rw, rh = (free[:, i][None, None, :] for i in range(4))
+
+        # Shape (sizes, orientation, free rectangles)
+        widths = np.stack([sizes[:, 0], sizes[:, 1]], axis=1)[:, :, None]
+        heights = np.stack([sizes[:, 1], sizes[:, 0]], axis=1)[:, :, None]
+
+        feasible = (widths <= rw) & (heights <= rh)
+        if not allow_rotation:
+            feasible[:, 1, :] = False
+        else:
+            # Square sizes gain nothing from turning
+            feasible[:, 1, :] &= (sizes[:, 0] != sizes[:, 1])[:, None]
+
+        if not feasible.any():
+            return None
+
+        keys = [np.broadcast_to(key, feasible.shape).ravel()
+                for key in self._score_arrays(rx, ry, rw, rh, widths, heights)]
+
+        # Lexicographic argmin: narrow the feasible triples key by key;
+        # flatnonzero keeps them in (size, orientation, rectangle) order
+        candidates = np.flatnonzero(feasible)
+        for key in keys:
+            values = key[candidates]
+            candidates = candidates[values == values.min()]
+        flat_index = int(candidates[0])
+
+        index, orientation, rect_index = np.unravel_index(flat_index, feasible.shape)
+        score = tuple(int(key[flat_index]) for key in keys)
+        x, y = self.free_rectangles[rect_index][:2]
+        return int(index), score, x, y, bool(orientation)
+
+    def _score_arrays(self, rx, ry, rw, rh, w, h):
+        # Array version of _score, returns the score tuple as a list of arrays
+        leftover_w = rw - w
+        leftover_h = rh - h
+        short_side = np.minimum(leftover_w, leftover_h)
+        long_side = np.maximum(leftover_w, leftover_h)
+
+        if self.heuristic == BEST_SHORT_SIDE_FIT:
+            return [short_side, long_side]
+        if self.heuristic == BEST_LONG_SIDE_FIT:
+            return [long_side, short_side]
+        if self.heuristic == BEST_AREA_FIT:
+            return [rw * rh - w * h, short_side]
+        if self.heuristic == BOTTOM_LEFT:
+            return [ry + h, rx + 0 * h]
+
+        return [-self._contact_score_arrays(rx, ry, w, h), ry + 0 * h, rx + 0 * h]
+
+    def _contact_score_arrays(self, x, y, w, h):
+        # Array version of _contact_score
+        score = np.where((x == self.x) | (x + w == self.x + self.width), h, 0)
+        score = score + np.where((y == self.y) | (y + h == self.y + self.height), w, 0)
+
+        for ux, uy, uw, uh in self.used_rectangles:
+            touches_side = (ux == x + w) | (ux + uw == x)
+            touches_end = (uy == y + h) | (uy + uh == y)
+            score = score + np.where(touches_side, self._common_interval_arrays(uy, uy + uh, y, y + h), 0)
+            score = score + np.where(touches_end, self._common_interval_arrays(ux, ux + uw, x, x + w), 0)
+
+        return score
+
+    def _common_interval_arrays(self, start1, end1, start2, end2):
+        overlap = np.minimum(end1, end2) - np.maximum(start1, start2)
+        return np.where((end1 < start2) | (end2 < start1), 0, overlap)
+
+    def _score(self, rx, ry, rw, rh, w, h):
+        # Score placing w x h at the top-left corner of free rectangle (rx, ry, rw, rh)
+        leftover_w = rw - w
+        leftover_h = rh - h
+        short_side = min(leftover_w, leftover_h)
+        long_side = max(leftover_w, leftover_h)
+
+        if self.heuristic == BEST_SHORT_SIDE_FIT:
+            return (short_side, long_side)
+        if self.heuristic == BEST_LONG_SIDE_FIT:
+            return (long_side, short_side)
+        if self.heuristic == BEST_AREA_FIT:
+            return (rw * rh - w * h, short_side)
+        if self.heuristic == BOTTOM_LEFT:
+            # Page coordinates grow downwards, so "bottom-left" packing
+            # pushes images towards the top-left corner of the page
+            return (ry + h, rx)
+
+        # Contact point: prefer positions touching the most edges
+        return (-self._contact_score(rx, ry, w, h), ry, rx)
+
+    def _contact_score(self, x, y, w, h):
+        # Total edge length shared with page borders and placed rectangles
+        score = 0
+
+        if x == self.x or x + w == self.x + self.width:
+            score += h
+        if y == self.y or y + h == self.y + self.height:
+            score += w
+
+        for ux, uy, uw, uh in self.used_rectangles:
+            if ux == x + w or ux + uw == x:
+                score += self._common_interval(uy, uy + uh, y, y + h)
+            if uy == y + h or uy + uh == y:
+                score += self._common_interval(ux, ux + uw, x, x + w)
+
+        return score
+
+    def _common_interval(self, start1, end1, start2, end2):
+        # Length of the overlap between two 1D intervals
+        if end1 < start2 or end2 < start1:
+            return 0
+        return min(end1, end2) - max(start1, start2)
+
+    def place(self, x, y, width, height):
+        # Mark (x, y, width, height) as used and update the free rectangles
+        used = (x, y, width, height)
+
+        new_rectangles = []
+        remaining = []
+        for free_rect in self.free_rectangles:
+            if self._intersects(free_rect, used):
+                new_rectangles.extend(self._split(free_rect, used))
+            else:
+                remaining.append(free_rect)
+
+        self.free_rectangles = remaining + self._prune_new_rectangles(remaining, new_rectangles)
+        self.used_rectangles.append(used)
+
+    def _intersects(self, r1, r2):
+        return (r1[0] < r2[0] + r2[2] and r2[0] < r1[0] + r1[2] and
+                r1[1] < r2[1] + r2[3] and r2[1] < r1[1] + r1[3])
+
+    def _split(self, free_rect, used):
+        # Split free_rect around used into up to four maximal rectangles
+        fx, fy, fw, fh = free_rect
+        ux, uy, uw, uh = used
+        pieces = []
+
+        # Left side
+        if ux > fx:
+            pieces.append((fx, fy, ux - fx, fh))
+        # Right side
+        if ux + uw < fx + fw:
+            pieces.append((ux + uw, fy, fx + fw - (ux + uw), fh))
+        # Top side
+        if uy > fy:
+            pieces.append((fx, fy, fw, uy - fy))
+        # Bottom side
+        if uy + uh < fy + fh:
+            pieces.append((fx, uy + uh, fw, fy + fh - (uy + uh)))
+
+        return pieces
+
+    def _prune_new_rectangles(self, remaining, new_rectangles):
+        # Only the pieces just split off can be redundant: each lies inside the
+        # free rectangle it came from, and untouched rectangles were already
+        # pruned against each other
+        keep = []
+        for i, r1 in enumerate(new_rectangles):
+            contained = any(self._contains(r2, r1) for r2 in remaining)
+            if not contained:
+                for j, r2 in enumerate(new_rectangles):
+                    if i != j and self._contains(r2, r1) and (r1 != r2 or j < i):
+                        contained = True
+                        break
+            if not contained:
+                keep.append(r1)
+        return keep
+
+    def _contains(self, outer, inner):
+        return (inner[0] >= outer[0] and inner[1] >= outer[1] and
+                inner[0] + inner[2] <= outer[0] + outer[2] and
+                inner[1] + inner[3] <= outer[1] + outer[3])
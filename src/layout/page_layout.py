@@ -1,16 +1,104 @@
+import math
+from collections import Counter
+
 from image_processor.image_handler import ImageHandler
+from layout.max_rects import MaxRectsBin, BEST_SHORT_SIDE_FIT
+from layout.free_space_index import FreeRectangleIndex
+from layout.layout_search import LayoutSearch
+from layout.layout_model import Placement, Page
+
+# Packing engines accepted by calculate_layout(strategy=...)
+STRATEGY_GUILLOTINE = 'guillotine'
+STRATEGY_MAXRECTS = 'maxrects'
+STRATEGY_SEARCH = 'search'
+STRATEGIES = (STRATEGY_GUILLOTINE, STRATEGY_MAXRECTS, STRATEGY_SEARCH)
 
 class PageLayout:
-    def __init__(self):
-        self.image_handler = ImageHandler()
+    def __init__(self, layout_cache=None, workers=None, use_processes=False, prepared_cache=None):
+        # layout_cache: optional LayoutCache for dimension-only layouts
+        # workers / use_processes: pool used to load and prepare images
+        # prepared_cache: optional PreparedImageCache for decoded, transformed images
+        self.image_handler = ImageHandler(workers, use_processes, prepared_cache)
+        self.layout_cache = layout_cache
+        # (path, message) for every file the last layout had to skip
+        self.preparation_errors = []
+        # Packing quality of the last full layout (see _layout_quality): the
+        # fixed reference update_layout measures incremental layouts against
+        self.reference_quality = None
         # A4 dimensions in pixels at 96 DPI
         self.a4_width = 794   # 210mm * 3.78
         self.a4_height = 1123  # 297mm * 3.78
+        # Used by strategy='search'; its last_result describes the winning combination
+        self.layout_search = LayoutSearch()
         
-    def calculate_layout(self, image_paths, margin_mm=5, spacing_mm=3, allow_rotation=True, max_reduction=0.25):
+    def calculate_layout(self, image_paths, margin_mm=5, spacing_mm=3, allow_rotation=True, max_reduction=0.25,
+                         strategy=STRATEGY_MAXRECTS, heuristic=BEST_SHORT_SIDE_FIT, load_pixels=True,
+                         optimize_scale=False):
         # Calculate optimal layout for images on A4 pages
+        # strategy: 'maxrects' (default), 'guillotine' (original packer) or 'search'
+        #           (try many orderings/heuristics in parallel within
+        #           self.layout_search.time_budget seconds and keep the best)
+        # heuristic: MaxRects placement rule, see layout.max_rects.HEURISTICS
+        # load_pixels: False reads only header dimensions; placements then carry
+        #              image=None and are rendered later with ImageHandler.render_image
+        # optimize_scale: shrink all images by a common factor within max_reduction
+        #                 when that saves pages (see _search_scale)
         # Returns: List of pages with image positions
         
+        return list(self.iter_pages(image_paths, margin_mm, spacing_mm, allow_rotation, max_reduction,
+                                    strategy, heuristic, load_pixels, optimize_scale))
+    
+    def iter_pages(self, image_paths, margin_mm=5, spacing_mm=3, allow_rotation=True, max_reduction=0.25,
+                   strategy=STRATEGY_MAXRECTS, heuristic=BEST_SHORT_SIDE_FIT, load_pixels=True,
+                   optimize_scale=False):
+        # Same arguments as calculate_layout, but yields finished pages one at a time
+        # There is no page cap: every image ends up on some page
+        # Returns: Generator of pages
+        
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown layout strategy: {strategy}")
+        
+        return self._iter_pages(image_paths, margin_mm, spacing_mm, allow_rotation, max_reduction,
+                                strategy, heuristic, load_pixels, optimize_scale)
+    
+    def _iter_pages(self, image_paths, margin_mm, spacing_mm, allow_rotation, max_reduction,
+                    strategy, heuristic, load_pixels, optimize_scale):
+        margin_px = int(margin_mm * 3.78)
+        spacing_px = int(spacing_mm * 3.78)
+        usable_width = self.a4_width - (2 * margin_px)
+        usable_height = self.a4_height - (2 * margin_px)
+        
+        # Serve dimension-only layouts from the cache when possible
+        cache_key = None
+        if self.layout_cache is not None and not load_pixels:
+            cache_key = self.layout_cache.make_key(image_paths, margin_mm, spacing_mm, allow_rotation,
+                                                   max_reduction, strategy, heuristic, optimize_scale)
+            cached_pages = self.layout_cache.get(cache_key)
+            if cached_pages is not None:
+                self.preparation_errors = []
+                yield from cached_pages
+                self.reference_quality = self._layout_quality(cached_pages, usable_width, usable_height, spacing_px)
+                return
+        
+        # Pages aren't kept unless cached (they may carry pixels): only their
+        # placed area is summed up for the reference quality
+        pages = []
+        page_count = used_area = 0
+        for page in self._iter_layout_pages(image_paths, margin_mm, spacing_mm, allow_rotation, max_reduction,
+                                            strategy, heuristic, load_pixels, optimize_scale):
+            if cache_key is not None:
+                pages.append(page)
+            page_count += 1
+            used_area += self._used_area(page['images'], spacing_px)
+            yield page
+        self.reference_quality = self._quality(used_area, page_count, usable_width, usable_height, spacing_px)
+        
+        # Only a fully consumed layout without skipped files is stored
+        if cache_key is not None and not self.preparation_errors:
+            self.layout_cache.put(cache_key, pages)
+    
+    def _iter_layout_pages(self, image_paths, margin_mm, spacing_mm, allow_rotation, max_reduction,
+                           strategy, heuristic, load_pixels, optimize_scale):
         # Convert mm to pixels
         margin_px = int(margin_mm * 3.78)
         spacing_px = int(spacing_mm * 3.78)
@@ -18,214 +106,483 @@ class PageLayout:
         available_width = self.a4_width - (2 * margin_px)
         available_height = self.a4_height - (2 * margin_px)
         
-        # Load and prepare all images
-        prepared_images = []
-        for path in image_paths:
-            image = self.image_handler.load_image(path)
-            prepared_image, was_rotated, was_resized, width, height = self.image_handler.prepare_image_for_page(
-                    image, available_width, available_height, margin_mm,
-                    allow_rotation, max_reduction
-                )
+        # Packing works on dimensions only: rotation (from preparation and from
+        # the packer) and scale stay a pending transform on each placement, and
+        # pixels are decoded once, already in their final orientation and size,
+        # when a page is rendered
+        prepared_images = self._prepare_images(image_paths, available_width, available_height, margin_mm,
+                                               allow_rotation, max_reduction, False)
+        
+        if optimize_scale:
+            # Probes share scaled entries and packings, and the area bound
+            # skips packing hopeless ones (see _search_scale)
+            pages = self._search_scale(prepared_images, available_width, available_height, margin_px, spacing_px,
+                                       allow_rotation, max_reduction, strategy, heuristic)
+        elif strategy == STRATEGY_SEARCH:
+            pages = self.layout_search.search(prepared_images, available_width, available_height,
+                                              margin_px, spacing_px, allow_rotation)
+        else:
+            # Sort by maximum dimension first, then by area
+            prepared_images.sort(key=lambda x: (max(x['width'], x['height']), x['width'] * x['height']),
+                                 reverse=True)
+            
+            # Pack images into pages using the selected algorithm
+            if strategy == STRATEGY_MAXRECTS:
+                pages = self._iter_pack_images_maxrects(prepared_images, available_width, available_height,
+                                                        margin_px, spacing_px, allow_rotation, heuristic)
+            else:
+                pages = self._iter_pack_images(prepared_images, available_width, available_height,
+                                               margin_px, spacing_px)
+        
+        if load_pixels:
+            pages = self._render_pages(pages)
+        yield from pages
+    
+    def _search_scale(self, prepared_images, available_width, available_height, margin_px, spacing_px,
+                      allow_rotation, max_reduction, strategy, heuristic, tolerance=0.01):
+        # Binary-search the largest common scale in [1 - max_reduction, 1] that
+        # still reaches the page count of the smallest allowed scale.
+        # Images that preparation already shrank further keep their own scale, so
+        # no image is ever reduced by more than max_reduction.
+        # Each scale's entries are built once and shared by the area bound, the
+        # probe and the final pack. Packings are memoised by the resulting image
+        # sizes, so probes whose sizes round to the same pixels (common once the
+        # interval is small) reuse one packing. A probe whose area lower bound
+        # already needs more pages than the target is decided without packing.
+        # Returns: List of pages
+        
+        # The parallel search is too slow to run per probe: probe with MaxRects
+        # and only search the final scale
+        probe_strategy = STRATEGY_MAXRECTS if strategy == STRATEGY_SEARCH else strategy
+        scaled = {}  # scale -> scaled entries
+        probes = {}  # image sizes -> pages
+        
+        def scale_images(scale):
+            scale = round(scale, 4)
+            if scale not in scaled:
+                scaled[scale] = self._scale_prepared_images(prepared_images, scale)
+            return scaled[scale]
+        
+        def pack(scale):
+            images = scale_images(scale)
+            sizes = tuple((img['width'], img['height']) for img in images)
+            if sizes not in probes:
+                probes[sizes] = self._pack_prepared(images, available_width, available_height, margin_px,
+                                                    spacing_px, probe_strategy, heuristic, allow_rotation)
+            return probes[sizes]
+        
+        low = max(0.01, 1 - max_reduction)
+        high = 1.0
+        target_pages = len(pack(low))
+        
+        if len(pack(high)) <= target_pages:
+            # Shrinking doesn't save a page
+            best_scale = high
+        else:
+            # Invariant: low reaches target_pages, high doesn't
+            best_scale = low
+            page_area = (available_width + spacing_px) * (available_height + spacing_px)
+            while high - low > tolerance:
+                middle = (low + high) / 2
+                
+                images = scale_images(middle)
+                used_area = sum((img['width'] + spacing_px) * (img['height'] + spacing_px) for img in images)
+                if math.ceil(used_area / page_area) > target_pages or len(pack(middle)) > target_pages:
+                    high = middle
+                else:
+                    low = middle
+                    best_scale = middle
+        
+        if strategy == STRATEGY_SEARCH:
+            images = scale_images(best_scale)
+            return self._pack_prepared(images, available_width, available_height, margin_px,
+                                       spacing_px, strategy, heuristic, allow_rotation)
+        return pack(best_scale)
+    
+    def _scale_prepared_images(self, prepared_images, scale):
+        # Copies of dimension-only entries with a common scale applied to the source size
+        scaled_images = []
+        for img_data in prepared_images:
+            if img_data['was_rotated']:
+                source_width, source_height = img_data['source_height'], img_data['source_width']
+            else:
+                source_width, source_height = img_data['source_width'], img_data['source_height']
             
-            prepared_images.append({
-                'original_path': path,
-                'image': prepared_image,
-                'width': width,
-                'height': height,
-                'was_rotated': was_rotated,
-                'was_resized': was_resized
+            image_scale = min(img_data['scale'], scale)
+            scaled = dict(img_data)
+            scaled.update({
+                'width': max(1, int(source_width * image_scale)),
+                'height': max(1, int(source_height * image_scale)),
+                'was_resized': image_scale < 1,
+                'scale': image_scale
             })
+            scaled_images.append(scaled)
+        
+        return scaled_images
+    
+    def _pack_prepared(self, prepared_images, available_width, available_height, margin_px, spacing_px,
+                       strategy, heuristic, allow_rotation):
+        # Sort and pack prepared entries with the given strategy
+        # Returns: List of pages
+        if strategy == STRATEGY_SEARCH:
+            return self.layout_search.search(prepared_images, available_width, available_height,
+                                             margin_px, spacing_px, allow_rotation)
+        
+        images = sorted(prepared_images, key=lambda x: (max(x['width'], x['height']), x['width'] * x['height']),
+                        reverse=True)
+        if strategy == STRATEGY_MAXRECTS:
+            return self._pack_images_maxrects(images, available_width, available_height,
+                                              margin_px, spacing_px, allow_rotation, heuristic)
+        return list(self._iter_pack_images(images, available_width, available_height, margin_px, spacing_px))
+    
+    def update_layout(self, previous_pages, added_paths=(), removed_paths=(), margin_mm=5, spacing_mm=3,
+                      allow_rotation=True, max_reduction=0.25, strategy=STRATEGY_MAXRECTS,
+                      heuristic=BEST_SHORT_SIDE_FIT, load_pixels=False, quality_tolerance=0.1,
+                      reference_quality=None):
+        # Update a finished layout after images were added to or removed from the selection
+        # previous_pages: layout computed with the same settings
+        # Removed images leave holes, added images fill holes on existing pages
+        # first and whatever is left goes onto new pages at the end.
+        # quality_tolerance: fall back to a full repack when the packing quality
+        #                    (area lower bound / page count) is more than this
+        #                    below the reference quality
+        # reference_quality: quality of the last full pack of this layout (None =
+        #                    self.reference_quality, set by the last full layout).
+        #                    It stays fixed across a series of updates, so small
+        #                    losses can't add up without a repack.
+        # Returns: List of pages
+        
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown layout strategy: {strategy}")
+        
+        margin_px = int(margin_mm * 3.78)
+        spacing_px = int(spacing_mm * 3.78)
+        available_width = self.a4_width - (2 * margin_px)
+        available_height = self.a4_height - (2 * margin_px)
+        
+        if reference_quality is None:
+            reference_quality = self.reference_quality
+        if reference_quality is None:
+            reference_quality = self._layout_quality(previous_pages, available_width, available_height, spacing_px)
+        
+        # Drop removed images (one placement per removed path occurrence)
+        pending_removals = Counter(removed_paths)
+        pages = []
+        for page in previous_pages:
+            kept_images = []
+            for img in page['images']:
+                if pending_removals[img['original_path']] > 0:
+                    pending_removals[img['original_path']] -= 1
+                else:
+                    kept_images.append(img)
+            pages.append({'page_number': page['page_number'], 'images': kept_images})
         
-        # Sort by maximum dimension first, then by area
+        prepared_images = self._prepare_images(list(added_paths), available_width, available_height, margin_mm,
+                                               allow_rotation, max_reduction, False)
         prepared_images.sort(key=lambda x: (max(x['width'], x['height']), x['width'] * x['height']), reverse=True)
         
-        # Pack images into pages using optimized algorithm
-        pages = self._pack_images(prepared_images, available_width, available_height, margin_px, spacing_px)
+        # Fill holes on existing pages (first fit, page bins rebuilt on demand)
+        page_bins = {}
+        unplaced_images = []
+        for img_data in prepared_images:
+            for page_idx, page in enumerate(pages):
+                if page_idx not in page_bins:
+                    page_bins[page_idx] = self._rebuild_page_bin(page, available_width, available_height,
+                                                                 margin_px, spacing_px, heuristic)
+                page_bin = page_bins[page_idx]
+                
+                position = page_bin.find_position(img_data['width'] + spacing_px,
+                                                  img_data['height'] + spacing_px,
+                                                  allow_rotation)
+                if position:
+                    _, x, y, rotated = position
+                    placement = self._make_placement(img_data, x, y, rotated)
+                    page_bin.place(x, y, placement['width'] + spacing_px, placement['height'] + spacing_px)
+                    page['images'].append(placement)
+                    break
+            else:
+                unplaced_images.append(img_data)
+        
+        # Leftovers go onto new pages
+        pages = [page for page in pages if page['images']]
+        if unplaced_images:
+            if strategy == STRATEGY_GUILLOTINE:
+                new_pages = self._iter_pack_images(unplaced_images, available_width, available_height,
+                                                   margin_px, spacing_px)
+            else:
+                new_pages = self._iter_pack_images_maxrects(unplaced_images, available_width, available_height,
+                                                            margin_px, spacing_px, allow_rotation, heuristic)
+            pages.extend(new_pages)
+        
+        pages = [Page(page_number, page['images']) for page_number, page in enumerate(pages, 1)]
         
+        # Too much fragmentation: repack everything from scratch
+        quality = self._layout_quality(pages, available_width, available_height, spacing_px)
+        if quality < reference_quality - quality_tolerance:
+            image_paths = [img['original_path'] for page in pages for img in page['images']]
+            return self.calculate_layout(image_paths, margin_mm, spacing_mm, allow_rotation, max_reduction,
+                                         strategy, heuristic, load_pixels)
+        
+        if load_pixels:
+            pages = list(self._render_pages(pages))
         return pages
     
+    def _rebuild_page_bin(self, page, usable_width, usable_height, margin_px, spacing_px, heuristic):
+        # MaxRects bin holding the placements already on a finished page
+        page_bin = MaxRectsBin(margin_px, margin_px,
+                               usable_width + spacing_px, usable_height + spacing_px,
+                               heuristic)
+        for img in page['images']:
+            page_bin.place(img['x'], img['y'], img['width'] + spacing_px, img['height'] + spacing_px)
+        return page_bin
+    
+    def _layout_quality(self, pages, usable_width, usable_height, spacing_px):
+        # Area lower bound on the page count divided by the actual page count
+        # Returns: 1.0 for a perfect packing, lower is worse
+        used_area = sum(self._used_area(page['images'], spacing_px) for page in pages)
+        return self._quality(used_area, len(pages), usable_width, usable_height, spacing_px)
+    
+    def _used_area(self, images, spacing_px):
+        return sum((img['width'] + spacing_px) * (img['height'] + spacing_px) for img in images)
+    
+    def _quality(self, used_area, page_count, usable_width, usable_height, spacing_px):
+        if not page_count:
+            return 1.0
+        page_area = (usable_width + spacing_px) * (usable_height + spacing_px)
+        return math.ceil(used_area / page_area) / page_count
+    
+    def _prepare_images(self, image_paths, available_width, available_height, margin_mm,
+                        allow_rotation, max_reduction, load_pixels=True):
+        # Prepare every image for packing on the image handler's worker pool
+        # Files that fail are skipped and listed in self.preparation_errors
+        # Returns: List of dicts with the prepared size and the transform applied to reach it
+        results = self.image_handler.prepare_many(image_paths, available_width, available_height, margin_mm,
+                                                  allow_rotation, max_reduction, load_pixels)
+        
+        prepared_images = []
+        self.preparation_errors = []
+        for path, result in zip(image_paths, results):
+            if isinstance(result, Exception):
+                print(f"DEBUG: Skipping {path}: {result}")
+                self.preparation_errors.append((path, str(result)))
+            else:
+                prepared_images.append(result)
+        
+        return prepared_images
+    
     def _pack_images(self, images, page_width, page_height, margin_px, spacing_px):
         # Pack images into pages using look-ahead free rectangle packing
-        # Added safety limits to prevent infinite loops
+        # Returns: List of pages (empty on error)
         
         try:
-            pages = []
+            return list(self._iter_pack_images(images, page_width, page_height, margin_px, spacing_px))
             
-            # Make a mutable copy of images to track unplaced ones
-            unplaced_images = images.copy()
+        except Exception as e:
+            print(f"DEBUG: Error in _pack_images: {e}")
+            import traceback
+            traceback.print_exc()
+            return []  # Return empty instead of freezing
+    
+    def _iter_pack_images(self, images, page_width, page_height, margin_px, spacing_px):
+        # Look-ahead free rectangle packing, yielding each page once it is full
+        # Every pass over a page either places an image or closes the page,
+        # so no attempt or page limits are needed
+        
+        # Make a mutable copy of images to track unplaced ones
+        unplaced_images = images.copy()
+        page_number = 0
+        
+        while unplaced_images:
+            # Start a new page
+            page_number += 1
+            current_page = {
+                'page_number': page_number,
+                'images': [],
+                'free_rectangles': FreeRectangleIndex([(margin_px, margin_px, 
+                                                        page_width - 2 * margin_px, 
+                                                        page_height - 2 * margin_px)])
+            }
             
-            # SAFETY: Maximum pages to prevent infinite loop
-            # No academic project needs more than 50 pages
-            max_total_pages = 50
+            placed_on_this_page = True
             
-            while unplaced_images and len(pages) < max_total_pages:
-                # Start a new page
-                current_page = {
-                    'page_number': len(pages) + 1,
-                    'images': [],
-                    'free_rectangles': [(margin_px, margin_px, 
-                                       page_width - 2 * margin_px, 
-                                       page_height - 2 * margin_px)]
-                }
-                
-                placed_on_this_page = True
-                
-                # SAFETY: Maximum attempts on current page
-                # Prevents infinite search loop
-                max_page_attempts = 100
-                page_attempts = 0
+            # Keep trying to place images until nothing fits
+            while placed_on_this_page and unplaced_images:
+                placed_on_this_page = False
                 
-                # Keep trying to place images until nothing fits
-                while placed_on_this_page and unplaced_images and page_attempts < max_page_attempts:
-                    page_attempts += 1
-                    placed_on_this_page = False
+                # Try each unplaced image (look-ahead)
+                for img_idx, img_data in enumerate(unplaced_images):
+                    img_width = img_data['width']
+                    img_height = img_data['height']
                     
-                    # Try each unplaced image (look-ahead)
-                    for img_idx, img_data in enumerate(unplaced_images):
-                        img_width = img_data['width']
-                        img_height = img_data['height']
+                    # Try both orientations
+                    best_rect = None
+                    best_rotation = False
+                    
+                    for rotation in [False, True]:
+                        if rotation and not img_data.get('was_rotated', False):
+                            continue
                         
-                        # Try both orientations
-                        best_rect = None
-                        best_rotation = False
+                        w = img_height if rotation else img_width
+                        h = img_width if rotation else img_height
                         
-                        for rotation in [False, True]:
-                            if rotation and not img_data.get('was_rotated', False):
-                                continue
-                            
-                            w = img_height if rotation else img_width
-                            h = img_width if rotation else img_height
-                            
-                            # Find fitting free rectangle
-                            for rect in current_page['free_rectangles']:
-                                rx, ry, rw, rh = rect
-                                if w <= rw and h <= rh:
-                                    if best_rect is None or ry < best_rect[1] or (ry == best_rect[1] and rx < best_rect[0]):
-                                        best_rect = rect
-                                        best_rotation = rotation
+                        # Find the top-left fitting free rectangle
+                        rect = current_page['free_rectangles'].find_top_left(w, h)
+                        if rect:
+                            rx, ry, rw, rh = rect
+                            if best_rect is None or ry < best_rect[1] or (ry == best_rect[1] and rx < best_rect[0]):
+                                best_rect = rect
+                                best_rotation = rotation
+                    
+                    if best_rect:
+                        # Place this image
+                        rx, ry, rw, rh = best_rect
+                        w = img_height if best_rotation else img_width
+                        h = img_width if best_rotation else img_height
                         
-                        if best_rect:
-                            # Place this image
-                            rx, ry, rw, rh = best_rect
-                            w = img_height if best_rotation else img_width
-                            h = img_width if best_rotation else img_height
-                            
-                            x = rx
-                            y = ry
-                            
-                            current_page['images'].append({
-                                'image': img_data['image'],
-                                'original_path': img_data['original_path'],
-                                'x': x,
-                                'y': y,
-                                'width': w,
-                                'height': h,
-                                'rotated': best_rotation or img_data['was_rotated'],
-                                'resized': img_data['was_resized']
-                            })
-                            
-                            # Remove used rectangle and split space
-                            current_page['free_rectangles'].remove(best_rect)
-                            
-                            # Split remaining space
-                            # Right rectangle
-                            if rw - w - spacing_px > 0:
-                                current_page['free_rectangles'].append(
-                                    (rx + w + spacing_px, ry, rw - w - spacing_px, h)
-                                )
-                            
-                            # Bottom rectangle
-                            if rh - h - spacing_px > 0:
-                                current_page['free_rectangles'].append(
-                                    (rx, ry + h + spacing_px, rw, rh - h - spacing_px)
-                                )
-                            
-                            # Top-right corner
-                            if rw - w - spacing_px > 0 and rh - h - spacing_px > 0:
-                                current_page['free_rectangles'].append(
-                                    (rx + w + spacing_px, ry + h + spacing_px, 
-                                     rw - w - spacing_px, rh - h - spacing_px)
-                                )
-                            
-                            # Merge adjacent rectangles
-                            self._merge_free_rectangles(current_page['free_rectangles'])
-                            
-                            # Remove image from unplaced list
-                            unplaced_images.pop(img_idx)
-                            placed_on_this_page = True
-                            break  # Restart the search after placement
-                
-                # SAFETY: If we hit max attempts, force start new page
-                if page_attempts >= max_page_attempts:
-                    print(f"DEBUG: Safety limit reached on page {len(pages) + 1}")
-                    # Force place first image on new page
-                    if unplaced_images:
-                        img_data = unplaced_images[0]
-                        x = margin_px
-                        y = margin_px
+                        current_page['images'].append(
+                            self._make_placement(img_data, rx, ry, best_rotation)
+                        )
                         
-                        current_page['images'].append({
-                            'image': img_data['image'],
-                            'original_path': img_data['original_path'],
-                            'x': x,
-                            'y': y,
-                            'width': img_data['width'],
-                            'height': img_data['height'],
-                            'rotated': img_data['was_rotated'],
-                            'resized': img_data['was_resized']
-                        })
+                        # Remove used rectangle and split space
+                        current_page['free_rectangles'].remove(best_rect)
                         
-                        unplaced_images.pop(0)
-                
-                # Add completed page
-                if current_page['images']:
-                    pages.append(self._finalize_page(current_page))
+                        # Split remaining space
+                        # Right rectangle
+                        if rw - w - spacing_px > 0:
+                            current_page['free_rectangles'].append(
+                                (rx + w + spacing_px, ry, rw - w - spacing_px, h)
+                            )
+                        
+                        # Bottom rectangle (full width, so it already covers the
+                        # bottom-right corner; a separate corner rectangle would
+                        # overlap it and let two images share the same space)
+                        if rh - h - spacing_px > 0:
+                            current_page['free_rectangles'].append(
+                                (rx, ry + h + spacing_px, rw, rh - h - spacing_px)
+                            )
+                        
+                        # Adjacent rectangles are merged by the index as they are added
+                        
+                        # Remove image from unplaced list
+                        unplaced_images.pop(img_idx)
+                        placed_on_this_page = True
+                        break  # Restart the search after placement
             
-            # SAFETY: Warn if we hit page limit
-            if len(pages) >= max_total_pages and unplaced_images:
-                print(f"WARNING: Stopped at {max_total_pages} pages. {len(unplaced_images)} images not placed.")
+            # Image larger than an empty page: give it a page of its own
+            if not current_page['images']:
+                img_data = unplaced_images.pop(0)
+                current_page['images'].append(
+                    self._make_placement(img_data, margin_px, margin_px, False)
+                )
             
-            return pages
+            yield self._finalize_page(current_page)
+    
+    def _pack_images_maxrects(self, images, usable_width, usable_height, margin_px, spacing_px,
+                              allow_rotation=True, heuristic=BEST_SHORT_SIDE_FIT):
+        # Pack images into pages using MaxRects
+        # Returns: List of pages
+        return list(self._iter_pack_images_maxrects(images, usable_width, usable_height, margin_px, spacing_px,
+                                                    allow_rotation, heuristic))
+    
+    def _iter_pack_images_maxrects(self, images, usable_width, usable_height, margin_px, spacing_px,
+                                   allow_rotation=True, heuristic=BEST_SHORT_SIDE_FIT):
+        # Pack images into pages using MaxRects with global best-fit selection
+        # Every image is inflated by spacing_px on its right and bottom edge, and
+        # the bin by the same amount, so spacing is only kept between images
+        
+        unplaced_images = images.copy()
+        page_number = 0
+        
+        while unplaced_images:
+            page_number += 1
+            page_bin = MaxRectsBin(margin_px, margin_px,
+                                   usable_width + spacing_px, usable_height + spacing_px,
+                                   heuristic)
+            current_page = {
+                'page_number': page_number,
+                'images': []
+            }
             
-        except Exception as e:
-            print(f"DEBUG: Error in _pack_images: {e}")
-            import traceback
-            traceback.print_exc()
-            return []  # Return empty instead of freezing
+            # Spacing-inflated sizes of the unplaced images, kept in step with the list
+            sizes = [(img_data['width'] + spacing_px, img_data['height'] + spacing_px)
+                     for img_data in unplaced_images]
+            
+            while unplaced_images:
+                # Pick the image/position pair with the best score on this page
+                best = page_bin.find_best(sizes, allow_rotation)
+                if best is None:
+                    break
+                
+                best_idx, _, x, y, rotated = best
+                sizes.pop(best_idx)
+                img_data = unplaced_images.pop(best_idx)
+                placement = self._make_placement(img_data, x, y, rotated)
+                page_bin.place(x, y, placement['width'] + spacing_px, placement['height'] + spacing_px)
+                current_page['images'].append(placement)
+            
+            # Image larger than an empty page: give it a page of its own
+            if not current_page['images']:
+                img_data = unplaced_images.pop(0)
+                current_page['images'].append(self._make_placement(img_data, margin_px, margin_px, False))
+            
+            yield self._finalize_page(current_page)
     
-    def _merge_free_rectangles(self, rectangles):
-        # Merge adjacent free rectangles to reduce fragmentation
-        
-        merged = True
-        while merged:
-            merged = False
-            i = 0
-            while i < len(rectangles):
-                j = i + 1
-                while j < len(rectangles):
-                    r1 = rectangles[i]
-                    r2 = rectangles[j]
-                    
-                    # Merge if same width and adjacent vertically
-                    if r1[0] == r2[0] and r1[2] == r2[2] and r1[1] + r1[3] == r2[1]:
-                        rectangles[i] = (r1[0], r1[1], r1[2], r1[3] + r2[3])
-                        rectangles.pop(j)
-                        merged = True
-                    # Merge if same height and adjacent horizontally
-                    elif r1[1] == r2[1] and r1[3] == r2[3] and r1[0] + r1[2] == r2[0]:
-                        rectangles[i] = (r1[0], r1[1], r1[2] + r2[2], r1[3])
-                        rectangles.pop(j)
-                        merged = True
-                    else:
-                        j += 1
-                i += 1
+    def _make_placement(self, img_data, x, y, rotated):
+        # Build a placed image entry, turning the bitmap if the packer rotated it
+        # Without pixels only the pending transform (rotated, final size) is recorded
+        image = img_data['image']
+        width = img_data['width']
+        height = img_data['height']
+        was_rotated = img_data['was_rotated']
+        
+        if rotated:
+            # Undo a rotation from preparation, otherwise rotate clockwise
+            if image is not None:
+                image = image.rotate(90 if was_rotated else -90, expand=True)
+            width, height = height, width
+            was_rotated = not was_rotated
+        
+        return Placement(
+            original_path=img_data['original_path'],
+            x=x,
+            y=y,
+            width=width,
+            height=height,
+            rotated=was_rotated,
+            resized=img_data['was_resized'],
+            scale=max(width, height) / max(img_data['source_width'], img_data['source_height']),
+            image=image
+        )
+    
+    def _render_pages(self, pages):
+        # Copies of dimension-only pages with every pending transform applied
+        # (each image decoded and resampled once); one pool of the image handler
+        # serves all pages and works ahead on the upcoming ones
+        # Files that fail to decode are dropped and listed in self.preparation_errors
+        batches = ((page, [(img.original_path, img.rotated, img.width, img.height)
+                           for img in page.images if img.image is None])
+                   for page in pages)
+        for page, rendered in self.image_handler.render_batches(batches):
+            yield self._render_page(page, rendered)
+    
+    def _render_page(self, page, rendered):
+        # page with its pending images replaced by the rendered ones, in order
+        rendered = iter(rendered)
+        images = []
+        for img in page.images:
+            if img.image is None:
+                image = next(rendered)
+                if isinstance(image, Exception):
+                    print(f"DEBUG: Skipping {img.original_path}: {image}")
+                    self.preparation_errors.append((img.original_path, str(image)))
+                    continue
+                img = img.replace(image=image)
+            images.append(img)
+        return page.replace(images=images)
     
     def _finalize_page(self, page_data):
         # Convert internal page format to final output format
-        return {
-            'page_number': page_data['page_number'],
-            'images': page_data['images']
-        }
+        return Page(page_data['page_number'], page_data['images'])
     
     def get_layout_summary(self, pages):
         # Get summary information about the layout